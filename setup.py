@@ -26,6 +26,8 @@ setup(
     long_description=long_description,
     long_description_content_type="text/markdown",
     install_requires=['requests', 'urllib3'],
+    extras_require={'arrow': ['pyarrow'], 'numpy': ['numpy']},
+    entry_points={'console_scripts': ['pyfortimanager-load=pyFortiManagerAPI:load_main']},
     url="https://github.com/akshaymane920/pyFortiManagerAPI",
     author="Akshay Mane",
     author_email="akshaymane920@gmail.com",
@@ -1,27 +1,2106 @@
 __author__ = "Akshay Mane"
 __version__ = "0.2.7"
 
+import abc
+import bisect
+import ipaddress
+import contextlib
+import collections
+import copy
+import csv
+import datetime
+import gzip
+import hashlib
+import inspect
 import json
 import os
+import socket
+import string
 import sys
+import threading
+import time
 
 import requests
 import urllib3
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Any
 from os.path import join, normpath
 
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
 # Disable insecure connections warnings
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
+_MISSING = object()
+
+
+# Result record models
+class Record:
+    """
+    Compact, read-only view of one table entry returned by FortiManager.
+    Frequently used fields live in __slots__ (strings interned, lists stored as tuples) and are exposed as
+    attributes eg. record.srcintf; every other field is kept as compact encoded JSON and only decoded when it
+    is accessed. Use as_dict() to get the raw dict back.
+    """
+    __slots__ = ("_extra",)
+    _fields = ()
+    _attrs = ()
+
+    def __init__(self, data):
+        for field, attr in zip(self._fields, self._attrs):
+            object.__setattr__(self, attr, _compact(data.get(field, _MISSING)))
+        rest = {key: value for key, value in data.items() if key not in self._fields}
+        object.__setattr__(self, "_extra", json.dumps(rest, separators=(",", ":")).encode() if rest else None)
+
+    @property
+    def extra(self):
+        """
+        Decode and return the fields that are not stored in slots
+        :return: dict of the remaining fields
+        """
+        return {} if self._extra is None else json.loads(self._extra)
+
+    def __getattr__(self, name):
+        # Only called for names that are not slots, i.e. rarely used fields. Private and special names are never
+        # fields: answering them here would decode the extra fields on every probe (hasattr(record, "__array__"))
+        # and recurse on objects being unpickled or copied, whose _extra slot is not set yet.
+        if name.startswith("_"):
+            raise AttributeError(name)
+        extra = self.extra
+        for key in (name, name.replace("_", "-"), name.replace("_", " ")):
+            if key in extra:
+                return extra[key]
+        raise AttributeError(f"{type(self).__name__!r} record has no field {name!r}")
+
+    def __getitem__(self, key):
+        if key in self._fields:
+            value = object.__getattribute__(self, self._attrs[self._fields.index(key)])
+            if value is not _MISSING:
+                return _expand(value)
+        else:
+            extra = self.extra
+            if key in extra:
+                return extra[key]
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} records are read-only")
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.as_dict() == other.as_dict()
+
+    def __hash__(self):
+        return hash((type(self), json.dumps(self.as_dict(), sort_keys=True, default=str)))
+
+    def __reduce__(self):
+        # pickle and copy rebuild the record from its raw dict
+        return type(self), (self.as_dict(),)
+
+    def __repr__(self):
+        return f"{type(self).__name__}(name={self.get('name')!r})"
+
+    def as_dict(self):
+        """
+        Rebuild the raw dict exactly as FortiManager returned it
+        :return: dict
+        """
+        data = {}
+        for field, attr in zip(self._fields, self._attrs):
+            value = object.__getattribute__(self, attr)
+            if value is not _MISSING:
+                data[field] = _expand(value)
+        data.update(self.extra)
+        return data
+
+
+def _compact(value):
+    if isinstance(value, str):
+        return sys.intern(value)
+    if isinstance(value, list):
+        return tuple(_compact(item) for item in value)
+    return value
+
+
+def _expand(value):
+    if isinstance(value, tuple):
+        return [_expand(item) for item in value]
+    return value
+
+
+def _record_field(attr):
+    def getter(self):
+        value = object.__getattribute__(self, attr)
+        return None if value is _MISSING else _expand(value)
+
+    return property(getter)
+
+
+def _record_type(name, fields, doc):
+    names = tuple(field.replace("-", "_").replace(" ", "_") for field in fields)
+    attrs = tuple(f"_{attr}" for attr in names)
+    namespace = {"__slots__": attrs, "_fields": tuple(fields), "_attrs": attrs, "__doc__": doc}
+    namespace.update({attr: _record_field(slot) for attr, slot in zip(names, attrs)})
+    return type(name, (Record,), namespace)
+
+
+FirewallPolicyRecord = _record_type(
+    "FirewallPolicyRecord",
+    ("policyid", "name", "uuid", "status", "action", "srcintf", "dstintf", "srcaddr", "dstaddr", "srcaddr6",
+     "dstaddr6", "service", "schedule", "nat", "logtraffic", "comments", "obj seq"),
+    "Record model for entries of get_firewall_policies()")
+
+AddressObjectRecord = _record_type(
+    "AddressObjectRecord",
+    ("name", "uuid", "type", "subnet", "fqdn", "start-ip", "end-ip", "associated-interface", "allow-routing",
+     "comment", "color"),
+    "Record model for entries of get_firewall_address_objects()")
+
+DeviceRecord = _record_type(
+    "DeviceRecord",
+    ("name", "oid", "sn", "ip", "hostname", "platform_str", "os_type", "os_ver", "mr", "build", "desc",
+     "conn_status", "conf_status", "dev_status", "db_status", "mgmt_mode", "ha_mode"),
+    "Record model for entries of get_devices()")
+
+
+def as_records(result, record_type):
+    """
+    Convert a FortiManager result into record models
+    :param result: list of dicts, a single dict, or an API result ([{"data": [...], "status": ...}, ...])
+                   or a full response ({"result": [...]}) as returned by the get_* methods
+    :param record_type: Record subclass to build eg. FirewallPolicyRecord, AddressObjectRecord, DeviceRecord
+    :return: list of records (the data of the first result entry when an API result is given)
+    """
+    if isinstance(result, dict) and "result" in result:
+        result = result["result"]
+    if isinstance(result, list) and result and isinstance(result[0], dict) and "status" in result[0] \
+            and "url" in result[0]:
+        result = result[0].get("data") or []
+    if isinstance(result, dict):
+        result = [result]
+    return [record_type(item) for item in result]
+
+
+def _with_records(result, record_type):
+    # Swap the "data" of every result entry for records, keeping status and url untouched.
+    for entry in result:
+        data = entry.get("data")
+        if isinstance(data, list):
+            entry["data"] = [record_type(item) for item in data]
+        elif isinstance(data, dict):
+            entry["data"] = record_type(data)
+    return result
+
+
+# Address helpers
+def _ipv4_range(value):
+    """
+    Convert an IPv4 subnet/range as FortiManager returns it into an inclusive integer range
+    :param value: ["10.0.0.0", "255.255.255.0"], "10.0.0.0/24", "10.0.0.0 255.255.255.0", "10.0.0.1-10.0.0.9"
+                  or a single address "10.0.0.1"
+    :return: (start, end) tuple of ints or None if value is not an IPv4 subnet/range
+    """
+    if isinstance(value, (list, tuple)):
+        if len(value) == 1:
+            value = value[0]
+        elif len(value) == 2:
+            value = "/".join(value)
+        else:
+            return None
+    if not isinstance(value, str) or not value:
+        return None
+    value = value.strip()
+    try:
+        if "-" in value:
+            start, end = value.split("-", 1)
+            return int(ipaddress.IPv4Address(start.strip())), int(ipaddress.IPv4Address(end.strip()))
+        network = ipaddress.IPv4Network(value.replace(" ", "/"), strict=False)
+    except ValueError:
+        return None
+    return int(network.network_address), int(network.broadcast_address)
+
+
+def _address_range(obj):
+    """
+    Integer range covered by an IPv4 address object (ipmask or iprange type)
+    :param obj: address object dict
+    :return: (start, end) tuple of ints or None for other object types
+    """
+    if obj.get("start-ip") and obj.get("end-ip") and obj.get("type") in ("iprange", 1):
+        return _ipv4_range(f"{obj['start-ip']}-{obj['end-ip']}")
+    if obj.get("type", "ipmask") in ("ipmask", 0) and obj.get("subnet"):
+        return _ipv4_range(obj["subnet"])
+    return None
+
+
+def _ip_field_range(field):
+    def extract(row):
+        return _ipv4_range(row.get(field))
+
+    return extract
+
+
+# Columnar export
+def _column(key):
+    return lambda row: row.get(key)
+
+
+def _range_column(extract, index):
+    def column(row):
+        ip_range = extract(row)
+        return None if ip_range is None else ip_range[index]
+
+    return column
+
+
+# table name: (url template, [(column name, extractor, kind), ...]); kind is "int", "str" or "list"
+_EXPORT_TABLES = {
+    "policies": ("pm/config/adom/{adom}/pkg/{package}/firewall/policy", [
+        ("policyid", _column("policyid"), "int"),
+        ("name", _column("name"), "str"),
+        ("status", _column("status"), "str"),
+        ("action", _column("action"), "str"),
+        ("srcintf", _column("srcintf"), "list"),
+        ("dstintf", _column("dstintf"), "list"),
+        ("srcaddr", _column("srcaddr"), "list"),
+        ("dstaddr", _column("dstaddr"), "list"),
+        ("service", _column("service"), "list"),
+        ("schedule", _column("schedule"), "list"),
+        ("nat", _column("nat"), "str"),
+        ("logtraffic", _column("logtraffic"), "str"),
+        ("comments", _column("comments"), "str"),
+        ("uuid", _column("uuid"), "str"),
+    ]),
+    "addresses": ("pm/config/adom/{adom}/obj/firewall/address", [
+        ("name", _column("name"), "str"),
+        ("type", _column("type"), "str"),
+        ("subnet_start", _range_column(_address_range, 0), "int"),
+        ("subnet_end", _range_column(_address_range, 1), "int"),
+        ("fqdn", _column("fqdn"), "str"),
+        ("associated_interface", _column("associated-interface"), "list"),
+        ("comment", _column("comment"), "str"),
+        ("uuid", _column("uuid"), "str"),
+    ]),
+    "vips": ("pm/config/adom/{adom}/obj/firewall/vip", [
+        ("name", _column("name"), "str"),
+        ("type", _column("type"), "str"),
+        ("extintf", _column("extintf"), "list"),
+        ("extip_start", _range_column(_ip_field_range("extip"), 0), "int"),
+        ("extip_end", _range_column(_ip_field_range("extip"), 1), "int"),
+        ("mappedip_start", _range_column(_ip_field_range("mappedip"), 0), "int"),
+        ("mappedip_end", _range_column(_ip_field_range("mappedip"), 1), "int"),
+        ("portforward", _column("portforward"), "str"),
+        ("extport", _column("extport"), "str"),
+        ("mappedport", _column("mappedport"), "str"),
+        ("comment", _column("comment"), "str"),
+        ("uuid", _column("uuid"), "str"),
+    ]),
+    "devices": ("dvmdb/adom/{adom}/device", [
+        ("name", _column("name"), "str"),
+        ("sn", _column("sn"), "str"),
+        ("ip", _range_column(_ip_field_range("ip"), 0), "int"),
+        ("hostname", _column("hostname"), "str"),
+        ("platform_str", _column("platform_str"), "str"),
+        ("os_ver", _column("os_ver"), "str"),
+        ("mr", _column("mr"), "int"),
+        ("build", _column("build"), "int"),
+        ("conn_status", _column("conn_status"), "str"),
+        ("conf_status", _column("conf_status"), "str"),
+        ("ha_mode", _column("ha_mode"), "str"),
+    ]),
+}
+
+
+def _column_value(value, kind):
+    if value is None:
+        return None
+    if kind == "list":
+        return [str(item) for item in value] if isinstance(value, list) else [str(value)]
+    if isinstance(value, list):
+        value = " ".join(str(item) for item in value)
+    if kind == "int":
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return None
+    return str(value)
+
+
+def _default_columnar_format():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return "numpy"
+    return "arrow"
+
+
+def _to_columns(columns, rows):
+    return {name: [_column_value(extract(row), kind) for row in rows] for name, extract, kind in columns}
+
+
+def _arrow_batch(columns, rows):
+    import pyarrow
+    types = {"int": pyarrow.int64(), "str": pyarrow.string(), "list": pyarrow.list_(pyarrow.string())}
+    values = _to_columns(columns, rows)
+    return pyarrow.RecordBatch.from_arrays([pyarrow.array(values[name], type=types[kind])
+                                            for name, _, kind in columns],
+                                           names=[name for name, _, _ in columns])
+
+
+def _numpy_batch(columns, rows):
+    import numpy
+    dtype = [(name, "i8" if kind == "int" else "O") for name, _, kind in columns]
+    values = _to_columns(columns, rows)
+    array = numpy.empty(len(rows), dtype=dtype)
+    for name, _, kind in columns:
+        if kind == "int":
+            array[name] = [-1 if value is None else value for value in values[name]]
+        else:
+            for index, value in enumerate(values[name]):
+                array[name][index] = value
+    return array
+
+
+# Policy analysis
+_SPACE_END = 2 ** 33 - 1  # IPv4 addresses and protocol/port keys are below 2**32, opaque objects above
+_ACTIONS = {0: "deny", 1: "accept", 2: "ipsec"}
+# Match criteria that are not modelled: policies which enable a flag or set a list are skipped
+_UNMODELLED_FLAGS = ("srcaddr-negate", "dstaddr-negate", "service-negate", "internet-service", "internet-service-src",
+                     "internet-service6", "internet-service6-src")
+_UNMODELLED_LISTS = ("users", "groups", "fsso-groups", "application", "url-category", "src-vendor-mac", "srcaddr6",
+                     "dstaddr6")
+
+
+def _unmodelled_criteria(policy):
+    return (any(policy.get(field) in (1, "enable") for field in _UNMODELLED_FLAGS)
+            or any(_names(policy.get(field)) for field in _UNMODELLED_LISTS))
+
+
+def _merge_ranges(ranges):
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return [tuple(item) for item in merged]
+
+
+def _ranges_subset(inner, outer):
+    # Both lists are merged and sorted, so a single sweep is enough.
+    index = 0
+    for start, end in inner:
+        while index < len(outer) and outer[index][1] < start:
+            index += 1
+        if index == len(outer) or outer[index][0] > start or outer[index][1] < end:
+            return False
+    return True
+
+
+def _ranges_intersect(first, second):
+    i = j = 0
+    while i < len(first) and j < len(second):
+        if first[i][1] < second[j][0]:
+            i += 1
+        elif second[j][1] < first[i][0]:
+            j += 1
+        else:
+            return True
+    return False
+
+
+def _names(value):
+    if value is None:
+        return []
+    return [str(item) for item in value] if isinstance(value, list) else str(value).split()
+
+
+class _NameResolver:
+    """
+    Resolve object and group names into merged integer ranges. Names that cannot be converted into ranges
+    (FQDN, geography, unknown...) each get a distinct point above the IPv4 space, so they only match themselves.
+    """
+
+    def __init__(self, ranges, groups, universe_names=()):
+        self._ranges = ranges
+        self._groups = groups
+        self._universe = {name.lower() for name in universe_names}
+        self._opaque = {}
+        self._cache = {}
+
+    def resolve(self, names):
+        key = tuple(names)
+        if key not in self._cache:
+            collected = []
+            for name in names:
+                collected.extend(self._resolve_name(name, set()))
+            self._cache[key] = _merge_ranges(collected)
+        return self._cache[key]
+
+    def _resolve_name(self, name, seen):
+        if name.lower() in self._universe:
+            return [(0, _SPACE_END)]
+        if name in self._ranges:
+            return self._ranges[name]
+        if name in self._groups and name not in seen:
+            seen.add(name)
+            collected = []
+            for member in self._groups[name]:
+                collected.extend(self._resolve_name(member, seen))
+            return collected
+        point = self._opaque.setdefault(name, 2 ** 32 + len(self._opaque))
+        return [(point, point)]
+
+
+def _service_ranges(service):
+    protocol = service.get("protocol", "TCP/UDP/SCTP")
+    if protocol in ("TCP/UDP/SCTP", 5):
+        ranges = []
+        for field, number in (("tcp-portrange", 6), ("udp-portrange", 17), ("sctp-portrange", 132)):
+            for token in _names(service.get(field)):
+                destination = token.split(":", 1)[0]
+                low, _, high = destination.partition("-")
+                try:
+                    ranges.append((number * 65536 + int(low), number * 65536 + int(high or low)))
+                except ValueError:
+                    return None
+        return ranges or None
+    if protocol in ("ICMP", 1):
+        return [(65536, 2 * 65536 - 1)]
+    if protocol in ("ICMP6", 6):
+        return [(58 * 65536, 59 * 65536 - 1)]
+    if protocol in ("IP", 2):
+        number = int(service.get("protocol-number") or 0)
+        if number == 0:
+            return [(0, _SPACE_END)]
+        return [(number * 65536, (number + 1) * 65536 - 1)]
+    return None
+
+
+def _interface_set(value):
+    names = set(_names(value))
+    return None if not names or "any" in names else names
+
+
+def _set_subset(inner, outer):
+    return outer is None or (inner is not None and inner <= outer)
+
+
+def _set_intersect(first, second):
+    return first is None or second is None or bool(first & second)
+
+
+def analyze_policies(policies, addresses=(), address_groups=(), services=(), service_groups=(),
+                     include_overlaps=True):
+    """
+    Find shadowed, redundant and overlapping firewall policies.
+    Addresses and services are resolved into merged integer ranges, every policy becomes a set of intervals per
+    dimension (source/destination interface, source/destination address, service, schedule). Candidate pairs are
+    found by comparing bounding boxes (vectorized with numpy when it is installed) and then confirmed exactly.
+    Disabled policies and policies matching on other criteria (negation, internet services, users and groups,
+    applications, URL categories, vendor MACs or IPv6 addresses) are not compared and listed in "skipped".
+    :param policies: policies in sequence order, as returned by get_firewall_policies()
+    :param addresses: IPv4 address objects
+    :param address_groups: address groups
+    :param services: custom service objects
+    :param service_groups: service groups
+    :param include_overlaps: also report partially overlapping policies with a different action
+    :return: dict with "shadowed" and "redundant" lists of {"policyid", "by"}, "overlaps" list of
+             {"policyid", "with"} and "skipped" list of policy ids that could not be analysed
+    """
+    address_ranges = {}
+    for obj in addresses:
+        ip_range = _address_range(obj)
+        if ip_range is not None:
+            address_ranges[obj["name"]] = [(0, _SPACE_END)] if ip_range == (0, 2 ** 32 - 1) else [ip_range]
+    addresses = _NameResolver(address_ranges, {grp["name"]: _names(grp.get("member")) for grp in address_groups},
+                              universe_names=("all",))
+    service_ranges = {}
+    for service in services:
+        ranges = _service_ranges(service)
+        if ranges is not None:
+            service_ranges[service["name"]] = ranges
+    services = _NameResolver(service_ranges, {grp["name"]: _names(grp.get("member")) for grp in service_groups},
+                             universe_names=("ALL",))
+
+    rules = []
+    skipped = []
+    for policy in sorted(policies, key=lambda item: item.get("obj seq", 0)):
+        if policy.get("status") in (0, "disable") or _unmodelled_criteria(policy):
+            skipped.append(policy.get("policyid"))
+            continue
+        source = addresses.resolve(_names(policy.get("srcaddr")))
+        destination = addresses.resolve(_names(policy.get("dstaddr")))
+        service = services.resolve(_names(policy.get("service")))
+        if not (source and destination and service):
+            skipped.append(policy.get("policyid"))
+            continue
+        schedule = set(_names(policy.get("schedule"))) or {"always"}
+        rules.append({
+            "policyid": policy.get("policyid"),
+            "action": _ACTIONS.get(policy.get("action"), policy.get("action")),
+            "srcintf": _interface_set(policy.get("srcintf")),
+            "dstintf": _interface_set(policy.get("dstintf")),
+            "schedule": None if "always" in schedule else schedule,
+            "ranges": (source, destination, service),
+        })
+
+    report = {"shadowed": [], "redundant": [], "overlaps": [], "skipped": skipped}
+    boxes = [[part for ranges in rule["ranges"] for part in (ranges[0][0], ranges[-1][1])] for rule in rules]
+    try:
+        import numpy
+        columns = [numpy.ascontiguousarray(column, dtype=numpy.int64)
+                   for column in numpy.asarray(boxes, dtype=numpy.int64).reshape(len(boxes), 6).T]
+    except ImportError:
+        columns = None
+    for index, rule in enumerate(rules):
+        covering, intersecting = _box_candidates(boxes, columns, index, include_overlaps)
+        for candidate in covering:
+            other = rules[candidate]
+            if _rule_covers(other, rule):
+                kind = "redundant" if other["action"] == rule["action"] else "shadowed"
+                report[kind].append({"policyid": rule["policyid"], "by": other["policyid"]})
+                break
+        else:
+            if include_overlaps:
+                for candidate in intersecting:
+                    other = rules[candidate]
+                    if other["action"] != rule["action"] and _rules_intersect(other, rule):
+                        report["overlaps"].append({"policyid": rule["policyid"], "with": other["policyid"]})
+    return report
+
+
+def _box_candidates(boxes, columns, index, include_overlaps):
+    """
+    Indices of the rules before index whose bounding box contains, resp. only intersects, the box of rule index
+    """
+    if index == 0:
+        return [], []
+    box = boxes[index]
+    if columns is not None:
+        covering = columns[0][:index] <= box[0]
+        for dim in range(1, 6):
+            if dim % 2:
+                covering &= columns[dim][:index] >= box[dim]
+            else:
+                covering &= columns[dim][:index] <= box[dim]
+        if not include_overlaps:
+            return covering.nonzero()[0].tolist(), []
+        intersecting = ~covering
+        for dim in range(6):
+            if dim % 2:
+                intersecting &= columns[dim][:index] >= box[dim - 1]
+            else:
+                intersecting &= columns[dim][:index] <= box[dim + 1]
+        return covering.nonzero()[0].tolist(), intersecting.nonzero()[0].tolist()
+    covering, intersecting = [], []
+    for candidate, other in enumerate(boxes[:index]):
+        if all(other[dim] <= box[dim] and other[dim + 1] >= box[dim + 1] for dim in (0, 2, 4)):
+            covering.append(candidate)
+        elif include_overlaps and all(other[dim] <= box[dim + 1] and other[dim + 1] >= box[dim]
+                                      for dim in (0, 2, 4)):
+            intersecting.append(candidate)
+    return covering, intersecting
+
+
+def _rule_covers(outer, inner):
+    return (_set_subset(inner["srcintf"], outer["srcintf"]) and _set_subset(inner["dstintf"], outer["dstintf"])
+            and _set_subset(inner["schedule"], outer["schedule"])
+            and all(_ranges_subset(part, whole) for part, whole in zip(inner["ranges"], outer["ranges"])))
+
+
+def _rules_intersect(first, second):
+    return (_set_intersect(first["srcintf"], second["srcintf"]) and _set_intersect(first["dstintf"],
+                                                                                   second["dstintf"])
+            and _set_intersect(first["schedule"], second["schedule"])
+            and all(_ranges_intersect(one, two) for one, two in zip(first["ranges"], second["ranges"])))
+
+
+# Address index
+def _ip_blocks(value):
+    """
+    Convert an IPv4/IPv6 subnet, address or "start-end" range into a list of ip_network objects, and of
+    (version, start, end) tuples for the ranges that are not a single subnet
+    """
+    if isinstance(value, (list, tuple)):
+        if len(value) == 2 and all(isinstance(item, str) for item in value):
+            try:
+                return [ipaddress.ip_network("/".join(value), strict=False)]
+            except ValueError:
+                pass
+        return [block for item in value for block in _ip_blocks(item)]
+    if not isinstance(value, str) or not value.strip():
+        return []
+    value = value.strip()
+    try:
+        if "-" in value:
+            start, end = (ipaddress.ip_address(part.strip()) for part in value.split("-", 1))
+            networks = list(ipaddress.summarize_address_range(start, end))
+            return networks if len(networks) == 1 else [(start.version, int(start), int(end))]
+        return [ipaddress.ip_network(value.replace(" ", "/"), strict=False)]
+    except (TypeError, ValueError):
+        return []
+
+
+class _RangeTable:
+    """
+    Address ranges split at their boundaries into segments, each listing the ranges that cover it. Ranges are
+    contiguous, so a range contains [first, last] when it covers the segments of both first and last.
+    """
+
+    def __init__(self, ranges):
+        """
+        :param ranges: list of (start, end, entry)
+        """
+        self._bounds = sorted({start for start, _, _ in ranges} | {end + 1 for _, end, _ in ranges})
+        self._segments = [[] for _ in self._bounds]
+        for start, end, entry in ranges:
+            for index in range(bisect.bisect_left(self._bounds, start), bisect.bisect_left(self._bounds, end + 1)):
+                if entry not in self._segments[index]:
+                    self._segments[index].append(entry)
+
+    def _segment(self, address):
+        index = bisect.bisect_right(self._bounds, address) - 1
+        return self._segments[index] if index >= 0 else []
+
+    def containing(self, first, last):
+        last_segment = self._segment(last)
+        return [entry for entry in self._segment(first) if entry in last_segment]
+
+    def overlapping(self, first, last):
+        found = []
+        for segment in self._segments[max(bisect.bisect_right(self._bounds, first) - 1, 0):
+                                      bisect.bisect_right(self._bounds, last)]:
+            found.extend(entry for entry in segment if entry not in found)
+        return found
+
+
+def _ip_key(ip):
+    # Fast path for plain IPv4 strings, the common case for flow logs.
+    if isinstance(ip, str) and "/" not in ip and ":" not in ip:
+        try:
+            return 4, int.from_bytes(socket.inet_aton(ip), "big"), 32
+        except OSError:
+            pass
+    network = ipaddress.ip_network(ip, strict=False)
+    return network.version, int(network.network_address), network.prefixlen
+
+
+class AddressIndex:
+    """
+    Prefix trie (one for IPv4, one for IPv6) over address objects, address groups and VIPs of an ADOM. IP ranges that
+    are not a single subnet are kept in a separate range table, queried alongside the trie.
+    Results are lists of (kind, name) tuples where kind is one of "address", "address6", "addrgrp", "addrgrp6",
+    "vip" (external IP) or "vip-mapped" (mapped IP). Groups are reported when one of their (nested) members matches.
+    """
+
+    def __init__(self, addresses=(), addresses6=(), address_groups=(), address_groups6=(), vips=()):
+        self._roots = {4: [None, None, None], 6: [None, None, None]}
+        self._groups = {}
+        ranges = {4: [], 6: []}
+        members = {}
+        for kind, groups in (("addrgrp", address_groups), ("addrgrp6", address_groups6)):
+            for group in groups:
+                for member in _names(group.get("member")):
+                    members.setdefault(member, set()).add((kind, group["name"]))
+        for kind, objects in (("address", addresses), ("address6", addresses6)):
+            for obj in objects:
+                if obj.get("start-ip") and obj.get("end-ip"):
+                    blocks = _ip_blocks(f"{obj['start-ip']}-{obj['end-ip']}")
+                else:
+                    blocks = _ip_blocks(obj.get("subnet") if kind == "address" else obj.get("ip6"))
+                self._add(blocks, (kind, obj["name"]), members, ranges)
+        for vip in vips:
+            self._add(_ip_blocks(vip.get("extip")), ("vip", vip["name"]), members, ranges)
+            self._add(_ip_blocks(vip.get("mappedip")), ("vip-mapped", vip["name"]), members, ranges)
+        self._ranges = {version: _RangeTable(items) for version, items in ranges.items()}
+
+    def _add(self, blocks, entry, members, ranges):
+        if not blocks:
+            return
+        if entry not in self._groups:
+            self._groups[entry] = self._parent_groups(entry[1], members)
+        for network in blocks:
+            if isinstance(network, tuple):
+                version, start, end = network
+                ranges[version].append((start, end, entry))
+                continue
+            node = self._node(network.version, int(network.network_address), network.prefixlen, create=True)
+            if node[2] is None:
+                node[2] = []
+            if entry not in node[2]:
+                node[2].append(entry)
+
+    @staticmethod
+    def _parent_groups(name, members):
+        found, pending = [], [name]
+        while pending:
+            for group in members.get(pending.pop(), ()):
+                if group not in found:
+                    found.append(group)
+                    pending.append(group[1])
+        return found
+
+    def _node(self, version, address, prefixlen, create=False):
+        bits = 32 if version == 4 else 128
+        node = self._roots[version]
+        for position in range(bits - 1, bits - 1 - prefixlen, -1):
+            bit = (address >> position) & 1
+            if node[bit] is None:
+                if not create:
+                    return None
+                node[bit] = [None, None, None]
+            node = node[bit]
+        return node
+
+    def _expand(self, entries):
+        result = []
+        for entry in entries:
+            if entry not in result:
+                result.append(entry)
+            for group in self._groups.get(entry, ()):
+                if group not in result:
+                    result.append(group)
+        return result
+
+    def lookup(self, ip):
+        """
+        Objects which contain the IP address or subnet
+        :param ip: IP address or subnet eg. "10.1.1.1", "10.1.1.0/24", "2001:db8::1"
+        :return: list of (kind, name) tuples
+        """
+        version, address, prefixlen = _ip_key(ip)
+        bits = 32 if version == 4 else 128
+        node = self._roots[version]
+        found = list(node[2] or ())
+        for position in range(bits - 1, bits - 1 - prefixlen, -1):
+            node = node[(address >> position) & 1]
+            if node is None:
+                break
+            if node[2]:
+                found.extend(node[2])
+        found.extend(self._ranges[version].containing(address, address | ((1 << (bits - prefixlen)) - 1)))
+        return self._expand(found)
+
+    def exact(self, subnet):
+        """
+        Objects defined exactly as the subnet
+        :param subnet: IP address or subnet
+        :return: list of (kind, name) tuples
+        """
+        node = self._node(*_ip_key(subnet))
+        return self._expand(node[2] or ()) if node is not None else []
+
+    def overlapping(self, subnet):
+        """
+        Objects which contain the subnet or are contained in it
+        :param subnet: IP address or subnet
+        :return: list of (kind, name) tuples
+        """
+        found = self.lookup(subnet)
+        version, address, prefixlen = _ip_key(subnet)
+        node = self._node(version, address, prefixlen)
+        pending = [child for child in (node or (None, None))[:2] if child is not None]
+        while pending:
+            node = pending.pop()
+            pending.extend(child for child in node[:2] if child is not None)
+            found.extend(node[2] or ())
+        bits = 32 if version == 4 else 128
+        found.extend(self._ranges[version].overlapping(address, address | ((1 << (bits - prefixlen)) - 1)))
+        return self._expand(found)
+
+    def lookup_many(self, ips):
+        """
+        Containment lookup for many IP addresses eg. from flow logs. Repeated addresses are resolved once.
+        :param ips: iterable of IP addresses
+        :return: dict of ip: list of (kind, name) tuples
+        """
+        results = {}
+        for ip in ips:
+            if ip not in results:
+                results[ip] = self.lookup(ip)
+        return results
+
+
+# Bulk helpers
+def _chunks(items, size):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+# Task states, see /task/task
+_TASK_SUCCESS_STATES = (4, "done", 8, "warning")
+_TASK_FINAL_STATES = _TASK_SUCCESS_STATES + (3, "cancelled", 5, "error", 7, "aborted")
+
+
+def _task_finished(task):
+    return task.get("state") in _TASK_FINAL_STATES or task.get("percent") == 100
+
+
+def _task_succeeded(task):
+    return task.get("state") in _TASK_SUCCESS_STATES and not task.get("num_err")
+
+
+def _task_outcome(taskid, task):
+    if task is None:
+        return "timeout" if taskid is not None else "not started"
+    if taskid is None:
+        return "failed"
+    return "done" if _task_succeeded(task) else "failed"
+
+
+def _started_task(result):
+    # taskid and status message of an exec call that creates a task eg. script execute or package install
+    code, message = _status_message(result)
+    return ((result[0].get("data") or {}).get("task") if code == 0 else None), message
+
+
+def _status_message(result):
+    status = (result or [{}])[0].get("status") or {}
+    return status.get("code", -1), status.get("message", "")
+
+
+# Proxy resources
+_DHCP_RESOURCE = "/api/v2/monitor/system/dhcp/select?&vdom=root&ipv6=true&scope=global"
+
+
+def _policy_lookup_resource(source_interface, source_ip, destination_ip, protocol, port, vdom):
+    return (f"/api/v2/monitor/firewall/policy-lookup/select?vdom={vdom}"
+            f"&srcintf={source_interface}"
+            f"&protocol={protocol}"
+            f"&sourceip={source_ip}"
+            f"&sourceport="
+            f"&dest={destination_ip}"
+            f"&destport={port}")
+
+
+# Configuration backups
+_CONFIG_BACKUP_RESOURCE = "/api/v2/monitor/system/config/backup?scope=global"
+
+
+def _check_device_name(device):
+    """
+    Raise ValueError if a device name cannot be used as a file name in the backup store
+    """
+    if not device or device in (".", "..") or any(sep in device for sep in ("/", "\\", os.sep, "\0")):
+        raise ValueError(f"invalid device name for the backup store: {device!r}")
+
+
+def _store_config(store_path, device, content):
+    """
+    Store a configuration gzip compressed as objects/<first 2 hex digits>/<other 62 hex digits>.gz of its sha256
+    and point devices/<device> at it. Objects that already exist are not rewritten.
+    :return: dict with "sha256", "path", "stored" (a new object was written) and "changed" (device ref moved)
+    """
+    _check_device_name(device)
+    data = content.encode() if isinstance(content, str) else content
+    digest = hashlib.sha256(data).hexdigest()
+    path = os.path.join(store_path, "objects", digest[:2], f"{digest[2:]}.gz")
+    stored = not os.path.exists(path)
+    if stored:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with gzip.open(temporary, "wb") as blob:
+            blob.write(data)
+        os.replace(temporary, path)
+    ref = os.path.join(store_path, "devices", device)
+    previous = None
+    if os.path.exists(ref):
+        with open(ref) as ref_file:
+            previous = ref_file.read().strip()
+    if previous != digest:
+        os.makedirs(os.path.dirname(ref), exist_ok=True)
+        with open(f"{ref}.tmp", "w") as ref_file:
+            ref_file.write(digest)
+        os.replace(f"{ref}.tmp", ref)
+    return {"sha256": digest, "path": path, "stored": stored, "changed": previous != digest}
+
+
+# Address consolidation
+def _address_key(obj):
+    """
+    Normalized definition of an address object used to find duplicates, None if it cannot be compared
+    """
+    if obj.get("dynamic_mapping"):
+        return None
+    interface = tuple(sorted(name for name in _names(obj.get("associated-interface")) if name != "any"))
+    if obj.get("type") in ("fqdn", 2) or (obj.get("fqdn") and not obj.get("subnet")):
+        fqdn = str(obj.get("fqdn") or "").strip().lower().rstrip(".")
+        return ("fqdn", fqdn, interface) if fqdn else None
+    ip_range = _address_range(obj)
+    return None if ip_range is None else ("range",) + ip_range + (interface,)
+
+
+def _replace_members(members, replacements):
+    result = []
+    for member in _names(members):
+        member = replacements.get(member, member)
+        if member not in result:
+            result.append(member)
+    return result
+
+
+def _package_paths(packages, prefix=""):
+    paths = []
+    for package in packages or []:
+        if package.get("type") == "folder":
+            paths.extend(_package_paths(package.get("subobj"), f"{prefix}{package['name']}/"))
+        else:
+            paths.append(f"{prefix}{package['name']}")
+    return paths
+
+
+# Session cache
+class SessionCache(abc.ABC):
+    """
+    Storage for FortiManager session ids shared between FortiManager objects and processes.
+    Subclass it and implement get/set/delete to plug in another backend (eg. redis).
+    """
+
+    @abc.abstractmethod
+    def get(self, key):
+        """
+        :return: the session id stored for key, or None
+        """
+
+    @abc.abstractmethod
+    def set(self, key, sessionid):
+        """
+        Store the session id of key
+        """
+
+    @abc.abstractmethod
+    def delete(self, key):
+        """
+        Forget the session id of key, if any
+        """
+
+
+class FileSessionCache(SessionCache):
+    """
+    SessionCache stored in a JSON file readable only by its owner, guarded by a lock file
+    (flock on POSIX systems) so that concurrent processes do not overwrite each other.
+    """
+
+    def __init__(self, path=None):
+        if path is None:
+            path = os.path.join(os.path.expanduser("~"), ".cache", "pyFortiManagerAPI", "sessions.json")
+        self.path = path
+
+    def _locked(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        return _FileLock(f"{self.path}.lock")
+
+    def _read(self):
+        try:
+            with open(self.path) as cache_file:
+                return json.load(cache_file)
+        except (OSError, ValueError):
+            return {}
+
+    def _write(self, sessions):
+        temporary = f"{self.path}.{os.getpid()}.tmp"
+        with open(os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as cache_file:
+            json.dump(sessions, cache_file)
+        os.replace(temporary, self.path)
+
+    def get(self, key):
+        with self._locked():
+            return self._read().get(key)
+
+    def set(self, key, sessionid):
+        with self._locked():
+            sessions = self._read()
+            sessions[key] = sessionid
+            self._write(sessions)
+
+    def delete(self, key):
+        with self._locked():
+            sessions = self._read()
+            if sessions.pop(key, None) is not None:
+                self._write(sessions)
+
+
+class _FileLock:
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def __enter__(self):
+        self.file = open(self.path, "a")
+        if fcntl is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        if fcntl is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+        self.file.close()
+
+
+# Record and replay
+_SECRET_KEYS = {"passwd", "password", "adm_pass", "session", "psksecret", "secret", "token", "api_key",
+                "private-key", "passphrase"}
+_REDACTED = "<redacted>"
+
+
+def _redact(value):
+    if isinstance(value, dict):
+        return {key: _REDACTED if key in _SECRET_KEYS and value[key] not in (None, "") else _redact(item)
+                for key, item in value.items()}
+    if isinstance(value, list):
+        return [_redact(item) for item in value]
+    return value
+
+
+def _cassette_key(payload):
+    return json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str)
+
+
+class Recorder:
+    """
+    Records the JSON-RPC calls of a FortiManager object to a cassette: a gzip compressed file with one JSON line
+    per call holding the request, the status code, the response, the latency and the time since recording started.
+    Passwords, session ids and other secrets are redacted from requests and responses.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: cassette file, overwritten
+        """
+        self.path = path
+        self._file = gzip.open(path, "wt", encoding="utf-8")
+        self._lock = threading.Lock()
+        self._start = time.monotonic()
+
+    def record(self, payload, response, latency):
+        """
+        Write one call to the cassette
+        :param payload: JSON-RPC request
+        :param response: requests response
+        :param latency: seconds the call took
+        """
+        try:
+            body = response.json()
+        except ValueError:
+            body = response.text
+        entry = {"request": _redact(payload), "status": response.status_code, "response": _redact(body),
+                 "latency": round(latency, 6), "at": round(time.monotonic() - self._start - latency, 6)}
+        line = json.dumps(entry, separators=(",", ":"), default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_cassette(path):
+    """
+    Read the calls recorded by a Recorder
+    :param path: cassette file
+    :return: list of dicts with request, status, response, latency and at
+    """
+    with gzip.open(path, "rt", encoding="utf-8") as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+class ReplayAdapter(requests.adapters.HTTPAdapter):
+    """
+    requests transport answering the calls recorded in a cassette instead of a FortiManager, for offline tests and
+    profiling. Use it with FortiManager(..., transport=ReplayAdapter(path)).
+
+    A call is matched on its redacted request, else on its method and urls; identical calls get the recorded
+    answers in recording order (eg. successive task polls) and the last one once they are used up.
+    """
+
+    def __init__(self, path, latency_scale=1.0):
+        """
+        :param path: cassette file written by a Recorder
+        :param latency_scale: factor applied to the recorded latencies, 0 to answer at once
+        """
+        super().__init__()
+        self.latency_scale = latency_scale
+        self.unmatched = 0
+        self._exact = {}
+        self._loose = {}
+        for entry in read_cassette(path):
+            self._exact.setdefault(_cassette_key(entry["request"]), []).append(entry)
+            self._loose.setdefault(self._loose_key(entry["request"]), []).append(entry)
+        self._used = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _loose_key(payload):
+        params = payload.get("params") or []
+        return _cassette_key([payload.get("method"), [param.get("url") for param in params]])
+
+    def _next(self, entries, key):
+        with self._lock:
+            index = self._used.get(key, 0)
+            self._used[key] = index + 1
+        return entries[min(index, len(entries) - 1)]
+
+    def send(self, request, **kwargs):
+        payload = _redact(json.loads(request.body)) if request.body else {}
+        key = _cassette_key(payload)
+        if key in self._exact:
+            entry = self._next(self._exact[key], ("exact", key))
+        else:
+            key = self._loose_key(payload)
+            if key not in self._loose:
+                self.unmatched += 1
+                raise requests.exceptions.ConnectionError(f"No recorded call for {key}", request=request)
+            entry = self._next(self._loose[key], ("loose", key))
+        if self.latency_scale:
+            time.sleep(entry["latency"] * self.latency_scale)
+        response = requests.models.Response()
+        response.status_code = entry["status"]
+        body = entry["response"]
+        response._content = (body if isinstance(body, str) else json.dumps(body)).encode()
+        response.headers["Content-Type"] = "application/json"
+        response.encoding = "utf-8"
+        response.url = request.url
+        response.request = request
+        response.elapsed = datetime.timedelta(seconds=entry["latency"])
+        return response
+
+
+# Request path
+class SingleFlight:
+    """
+    In-flight deduplication: while a call for a key is running, other callers asking for the same key wait for it
+    and get its result instead of making their own call. Nothing is cached once the call has finished.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, function):
+        """
+        Call function() or wait for the running call with the same key
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {"done": threading.Event(), "result": None, "error": None}
+        if leader:
+            try:
+                call["result"] = function()
+            except BaseException as error:
+                call["error"] = error
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call["done"].set()
+        else:
+            call["done"].wait()
+        if call["error"] is not None:
+            raise call["error"]
+        return call["result"]
+
+
+class AdaptiveLimiter:
+    """
+    AIMD limit on the number of requests in flight, driven by a windowed latency gradient. Every latency is divided
+    by the baseline latency of its endpoint (JSON-RPC method and url), the lowest seen recently, so a mix of fast
+    and slow calls gives ratios close to 1 while FortiManager is not loaded. Ratios are averaged over windows of at
+    least one round trip (limit requests, min_window at least): the limit grows by one request per window while
+    the mean stays under latency_tolerance, and is multiplied by backoff when it is above, on errors or on busy
+    answers (HTTP 429 and 5xx), at most once per round trip. Waiting requests get free slots in arrival order.
+    """
+
+    def __init__(self, initial=4, min_limit=1, max_limit=64, latency_tolerance=2.0, backoff=0.5, min_window=10,
+                 endpoints=1000):
+        """
+        :param initial: limit used for the first requests
+        :param min_limit: the limit never goes below this
+        :param max_limit: the limit never goes above this
+        :param latency_tolerance: windows whose mean latency is above latency_tolerance times the baseline latency
+        of their endpoints count as overload
+        :param backoff: factor applied to the limit on overload
+        :param min_window: minimum number of requests per window
+        :param endpoints: number of endpoints whose baseline latency is kept, least recently used ones are dropped
+        """
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_tolerance = latency_tolerance
+        self.backoff = backoff
+        self.min_window = min_window
+        self.limit = float(min(max(initial, min_limit), max_limit))
+        self.in_flight = 0
+        self.gradient = None
+        self.requests = 0
+        self.errors = 0
+        self.decreases = 0
+        self._baselines = collections.OrderedDict()
+        self._max_endpoints = endpoints
+        self._window = []
+        self._last_decrease = 0.0
+        self._queue = collections.deque()
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        """
+        Wait for a free slot, in arrival order
+        :return: start time to pass to release()
+        """
+        ticket = object()
+        with self._condition:
+            self._queue.append(ticket)
+            try:
+                while self._queue[0] is not ticket or self.in_flight >= int(self.limit):
+                    self._condition.wait()
+            finally:
+                self._queue.remove(ticket)
+                self._condition.notify_all()
+            self.in_flight += 1
+        return time.monotonic()
+
+    def _decrease(self):
+        self.limit = max(self.min_limit, self.limit * self.backoff)
+        self.decreases += 1
+        self._last_decrease = time.monotonic()
+        self._window.clear()
+
+    def _ratio(self, key, latency):
+        baseline = self._baselines.pop(key, None)
+        # the baseline follows the lowest latency and drifts up slowly so it adapts to a slower server
+        baseline = latency if baseline is None else min(latency, baseline * 1.001)
+        self._baselines[key] = baseline
+        if len(self._baselines) > self._max_endpoints:
+            self._baselines.popitem(last=False)
+        return latency / baseline if baseline else 1.0
+
+    def release(self, start, ok=True, key=None):
+        """
+        Free the slot taken by acquire() and adjust the limit
+        :param start: value returned by acquire()
+        :param ok: False if the request failed or the server was busy
+        :param key: endpoint of the request, eg. JSON-RPC method and url, its latency is compared to the latency
+        of earlier requests with the same key
+        """
+        latency = time.monotonic() - start
+        with self._condition:
+            self.in_flight -= 1
+            self.requests += 1
+            if not ok:
+                self.errors += 1
+                # only requests started after the last decrease may decrease the limit again
+                if start >= self._last_decrease:
+                    self._decrease()
+            else:
+                ratio = self._ratio(key, latency)
+                if start >= self._last_decrease:
+                    self._window.append(ratio)
+                if len(self._window) >= max(self.min_window, int(self.limit)):
+                    self.gradient = sum(self._window) / len(self._window)
+                    self._window.clear()
+                    if self.gradient > self.latency_tolerance:
+                        self._decrease()
+                    else:
+                        self.limit = min(self.max_limit, self.limit + 1)
+            self._condition.notify_all()
+
+    def metrics(self):
+        """
+        :return: dict with the current limit, requests in flight and waiting, the mean latency / baseline latency
+        ratio of the last window and counters
+        """
+        with self._condition:
+            return {"limit": int(self.limit), "in_flight": self.in_flight, "waiting": len(self._queue),
+                    "gradient": self.gradient, "requests": self.requests, "errors": self.errors,
+                    "decreases": self.decreases}
+
+
+def _percentile(values, percent):
+    values = sorted(values)
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+class RequestScheduler:
+    """
+    Priority lanes for the requests of a FortiManager object. Lanes are listed from the highest priority to the
+    lowest: a free slot always goes to the highest priority lane with a waiting request, each lane can be capped to
+    a number of requests in flight and all lanes together are capped to max_in_flight (or to the limit of the
+    concurrency_limiter when one is used).
+    """
+
+    def __init__(self, lanes=None, max_in_flight=10):
+        """
+        :param lanes: dict of lane name: maximum requests in flight for the lane (None for no lane cap), highest
+        priority first. Default is {"interactive": None, "bulk": max_in_flight - 2}
+        :param max_in_flight: maximum requests in flight over all lanes, use the pool_maxsize of the FortiManager
+        """
+        if lanes is None:
+            lanes = {"interactive": None, "bulk": max(1, max_in_flight - 2)}
+        self.max_in_flight = max_in_flight
+        self.lanes = list(lanes)
+        self.caps = dict(lanes)
+        self.in_flight = 0
+        self._stats = {lane: {"requests": 0, "in_flight": 0, "wait_total": 0.0, "wait_max": 0.0,
+                              "waits": collections.deque(maxlen=1000)} for lane in self.lanes}
+        # waiting requests of every lane, served in arrival order
+        self._queues = {lane: collections.deque() for lane in self.lanes}
+        self._condition = threading.Condition()
+
+    @property
+    def default_lane(self):
+        return self.lanes[0]
+
+    def _admissible(self, lane, ticket, limit):
+        if self._queues[lane][0] is not ticket:
+            return False
+        if self.in_flight >= (self.max_in_flight if limit is None else limit()):
+            return False
+        if self.caps[lane] is not None and self._stats[lane]["in_flight"] >= self.caps[lane]:
+            return False
+        for other in self.lanes[:self.lanes.index(lane)]:
+            if self._queues[other] and (self.caps[other] is None or
+                                        self._stats[other]["in_flight"] < self.caps[other]):
+                return False
+        return True
+
+    def acquire(self, lane, limit=None):
+        """
+        Wait for a slot in a lane
+        :param lane: name of the lane
+        :param limit: optional function returning the current maximum of requests in flight over all lanes
+        """
+        if lane not in self._stats:
+            raise ValueError(f"Unknown lane {lane}, lanes are {self.lanes}")
+        start = time.monotonic()
+        stats = self._stats[lane]
+        ticket = object()
+        with self._condition:
+            self._queues[lane].append(ticket)
+            try:
+                while not self._admissible(lane, ticket, limit):
+                    self._condition.wait()
+            finally:
+                self._queues[lane].remove(ticket)
+                self._condition.notify_all()
+            wait = time.monotonic() - start
+            self.in_flight += 1
+            stats["in_flight"] += 1
+            stats["requests"] += 1
+            stats["wait_total"] += wait
+            stats["wait_max"] = max(stats["wait_max"], wait)
+            stats["waits"].append(wait)
+
+    def release(self, lane):
+        """
+        Free the slot taken by acquire()
+        """
+        with self._condition:
+            self.in_flight -= 1
+            self._stats[lane]["in_flight"] -= 1
+            self._condition.notify_all()
+
+    def metrics(self):
+        """
+        :return: dict of lane: requests, waiting, in_flight and queue wait statistics in seconds (the percentiles
+        cover the last 1000 requests)
+        """
+        with self._condition:
+            return {lane: {"requests": stats["requests"], "waiting": len(self._queues[lane]),
+                           "in_flight": stats["in_flight"],
+                           "wait_mean": stats["wait_total"] / stats["requests"] if stats["requests"] else None,
+                           "wait_p50": _percentile(stats["waits"], 50), "wait_p99": _percentile(stats["waits"], 99),
+                           "wait_max": stats["wait_max"]}
+                    for lane, stats in self._stats.items()}
+
+
+def _busy(response):
+    return response.status_code == 429 or response.status_code >= 500
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """
+    Raised instead of sending a request while the circuit breaker of the host is open
+    """
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker for one FortiManager host. After failure_threshold consecutive failed requests (transport
+    errors, HTTP 429 or 5xx) the circuit opens and requests fail at once with CircuitOpenError. After reset_timeout
+    seconds up to half_open_requests probe requests are let through: a success closes the circuit, a failure opens
+    it again.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30, half_open_requests=1):
+        """
+        :param failure_threshold: consecutive failures that open the circuit
+        :param reset_timeout: seconds the circuit stays open before probing the host
+        :param half_open_requests: probe requests allowed at the same time while half-open
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_requests = half_open_requests
+        self.state = "closed"
+        self.failures = 0
+        self.opened = 0
+        self.rejected = 0
+        self.last_error = None
+        self._opened_at = None
+        self._probes = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """
+        :return: True if a request may be sent now
+        """
+        with self._lock:
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                self._probes = 0
+            if self.state == "closed":
+                return True
+            if self.state == "half_open" and self._probes < self.half_open_requests:
+                self._probes += 1
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+
+    def record_failure(self, error=None):
+        """
+        :param error: description of the failure, kept for metrics()
+        """
+        with self._lock:
+            self.failures += 1
+            self.last_error = error
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.opened += 1
+                self.state = "open"
+                self._opened_at = time.monotonic()
+
+    def metrics(self):
+        """
+        :return: dict with the state, consecutive failures, times opened, rejected requests, last error and
+        seconds until the next probe while open
+        """
+        with self._lock:
+            retry_in = None
+            if self.state == "open":
+                retry_in = max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+            return {"state": self.state, "failures": self.failures, "opened": self.opened,
+                    "rejected": self.rejected, "last_error": self.last_error, "retry_in": retry_in}
+
+
+class _Session(requests.Session):
+    """
+    requests session used by FortiManager, every JSON-RPC call goes through request()
+    """
+
+    def __init__(self, client):
+        super().__init__()
+        self.single_flight = SingleFlight() if client.coalesce_reads else None
+        self.limiter = client.concurrency_limiter
+        self.scheduler = client.scheduler
+        self.breaker = client.circuit_breaker
+        self.timeout = client.timeout
+        self.recorder = client.recorder
+        self.connection = client._connection
+
+    def request(self, method, url, *args, **kwargs):
+        payload = kwargs.get("json")
+        if self.single_flight is not None and isinstance(payload, dict) and payload.get("method") == "get":
+            key = json.dumps(payload, sort_keys=True, default=str)
+            return self.single_flight.do(key, lambda: self._send(method, url, *args, **kwargs))
+        return self._send(method, url, *args, **kwargs)
+
+    def _send(self, method, url, *args, **kwargs):
+        if self.timeout is not None:
+            kwargs.setdefault("timeout", self.timeout)
+        if self.breaker is None:
+            return self._scheduled(method, url, *args, **kwargs)
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"Circuit open for {url}: {self.breaker.last_error}")
+        try:
+            response = self._scheduled(method, url, *args, **kwargs)
+        except BaseException as error:
+            # also for errors which are not the host's fault so a half-open probe is never left pending
+            self.breaker.record_failure(repr(error))
+            raise
+        if _busy(response):
+            self.breaker.record_failure(f"HTTP {response.status_code}")
+        else:
+            self.breaker.record_success()
+        return response
+
+    def _scheduled(self, method, url, *args, **kwargs):
+        if self.scheduler is None:
+            return self._limited(method, url, *args, **kwargs)
+        lane = getattr(self.connection.local, "lane", None) or self.scheduler.default_lane
+        self.scheduler.acquire(lane, None if self.limiter is None else lambda: int(self.limiter.limit))
+        try:
+            return self._limited(method, url, *args, **kwargs)
+        finally:
+            self.scheduler.release(lane)
+
+    def _limited(self, method, url, *args, **kwargs):
+        if self.limiter is None:
+            return self._http(method, url, *args, **kwargs)
+        payload = kwargs.get("json")
+        key = None
+        if isinstance(payload, dict):
+            key = (payload.get("method"), ((payload.get("params") or [{}])[0] or {}).get("url"))
+        start = self.limiter.acquire()
+        try:
+            response = self._http(method, url, *args, **kwargs)
+        except requests.exceptions.RequestException:
+            self.limiter.release(start, ok=False)
+            raise
+        except BaseException:
+            self.limiter.release(start)
+            raise
+        self.limiter.release(start, ok=not _busy(response), key=key)
+        return response
+
+    def _http(self, method, url, *args, **kwargs):
+        if self.recorder is None:
+            return super().request(method, url, *args, **kwargs)
+        start = time.monotonic()
+        response = super().request(method, url, *args, **kwargs)
+        self.recorder.record(kwargs.get("json"), response, time.monotonic() - start)
+        return response
+
+
+class _Connection:
+    """
+    Login state shared by a FortiManager object and its adom views
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.session = None
+        self.sessionid = None
+        # per thread request lane, see FortiManager.using_lane()
+        self.local = threading.local()
+
+
+# Endpoint registry
+def _template_fields(template):
+    return [field for _, field, _, _ in string.Formatter().parse(template) if field]
+
+
+class _Endpoint:
+    """
+    One JSON-RPC call of FortiManager from which a FortiManager method is derived, see _with_endpoints()
+    """
+    __slots__ = ("name", "method", "url", "args", "defaults", "annotations", "suffix", "optional", "data", "extra",
+                 "result", "doc")
+
+    def __init__(self, name, method, url, args=(), suffix=None, data=None, extra=None, result="result", doc=None,
+                 annotations=None):
+        """
+        :param name: name of the FortiManager method
+        :param method: JSON-RPC method, eg. "get"
+        :param url: url template, formatted with the arguments of the method and adom (the adom in use)
+        :param args: arguments of the method, a name or a (name, default) tuple each
+        :param suffix: template appended to the url when the argument it uses is set, eg. "/{name}"
+        :param data: function of the arguments returning the "data" of the request
+        :param extra: function of the arguments returning other keys of the request params, eg. "filter"
+        :param result: "result" to return the result list of the response, "json" for the whole response
+        :param doc: docstring of the method
+        :param annotations: dict of argument name: annotation of the method, eg. {"name": str}
+        """
+        self.name = name
+        self.method = method
+        self.url = url
+        self.args = tuple(arg if isinstance(arg, str) else arg[0] for arg in args)
+        self.defaults = dict(arg for arg in args if not isinstance(arg, str))
+        self.annotations = annotations or {}
+        self.suffix = suffix
+        self.optional = _template_fields(suffix)[0] if suffix else None
+        self.data = data
+        self.extra = extra
+        self.result = result
+        self.doc = doc
+
+
+_ENDPOINTS = (
+    # Adoms
+    _Endpoint("get_adoms", "get", "dvmdb/adom", [("name", False)], suffix="/{name}",
+              extra=lambda values: {"option": "object member"},
+              doc="""
+        Get all adoms from the FortiManager
+        :param name: Can get specific adom using name as a filter
+        :return: Response of status code with data in JSON Format
+        """),
+    # Devices
+    _Endpoint("get_device", "get", "/dvmdb/adom/{adom}/device/{device}", ["device"], result="json",
+              doc="""
+        Get one device added in FortiManager
+        :param device: name of the device
+        :return: Response in JSON Format
+        """),
+    _Endpoint("get_meta_data", "get", "/dvmdb/_meta_fields/device", result="json",
+              doc="""
+        Get all the meta tags present in the FortiManager
+        :return: returns meta tags present in FortiManager
+        """),
+    _Endpoint("add_meta_data", "add", "/dvmdb/_meta_fields/device", ["name", ("importance", 0), ("status", 1)],
+              data=lambda values: {"importance": values["importance"], "length": 255, "name": f"{values['name']}",
+                                   "status": values["status"]},
+              result="json",
+              doc="""
+        Add a meta tag in the FortiManager.
+        :param name: name of the meta tag
+        :param importance: importance of meta tag
+        :param status: status of meta tag whether it should be active(1) or disabled(0)
+        :return: returns response from FortiManager API whether the request was successful or not.!
+        """),
+    _Endpoint("assign_meta_to_device", "update", "/dvmdb/adom/{adom}/device/{device}",
+              ["device", "meta_name", "meta_value"],
+              data=lambda values: {"name": f"{values['device']}",
+                                   "meta fields": {f"{values['meta_name']}": f"{values['meta_value']}"}},
+              result="json",
+              doc="""
+        Assign a meta tag to the device
+        :param device: name of the device
+        :param meta_name: name of the meta tag
+        :param meta_value: value of the meta tag
+        :return: returns response from FortiManager API whether the request was successful or not.!
+        """),
+    _Endpoint("assign_meta_to_device_vdom", "update", "/dvmdb/adom/{adom}/device/{device}/vdom/{vdom}",
+              ["device", "vdom", "meta_name", "meta_value"],
+              data=lambda values: {"name": f"{values['device']}",
+                                   "meta fields": {f"{values['meta_name']}": f"{values['meta_value']}"}},
+              result="json",
+              doc="""
+        Assign a meta tag to the device
+        :param device: name of the device
+        :param vdom: Specify the Vdom
+        :param meta_name: name of the meta tag
+        :param meta_value: value of the meta tag
+        :return: returns response from FortiManager API whether the request was successful or not.!
+        """),
+    # Device groups
+    _Endpoint("create_device_group", "add", "/dvmdb/adom/{adom}/group/{name}", ["name", ("description", "")],
+              data=lambda values: {"name": values["name"], "desc": values["description"], "type": "normal",
+                                   "meta fields": {}, "os_type": "fos"},
+              doc="""
+        Create a device group
+        :param name: name of the group
+        :param description: description of the group
+        """),
+    _Endpoint("add_device_to_group", "add", "/dvmdb/adom/{adom}/group/{group}/object member",
+              ["group", "device", "vdom"], data=lambda values: [{"name": values["device"], "vdom": values["vdom"]}],
+              doc="""
+        Add a device to a device group, see add_devices_to_group() for many devices
+        :param group: name of the group
+        :param device: name of the device
+        :param vdom: vdom of the device
+        """),
+    _Endpoint("delete_device_to_group", "delete", "/dvmdb/adom/{adom}/group/{group}/object member",
+              ["group", "device", "vdom"], data=lambda values: [{"name": values["device"], "vdom": values["vdom"]}],
+              doc="""
+        Remove a device from a device group, see delete_devices_from_group() for many devices
+        :param group: name of the group
+        :param device: name of the device
+        :param vdom: vdom of the device
+        """),
+    # Policy packages
+    _Endpoint("get_policy_packages", "get", "pm/pkg/adom/{adom}/", [("name", False)], suffix="{name}",
+              doc="""
+        Get all the policy packages configured on FortiManager
+        :param name: Can get specific package using name as a filter
+        :return: Response of status code with data in JSON Format
+        """),
+    _Endpoint("install_policy_package", "exec", "securityconsole/install/package", ["package_name"],
+              data=lambda values: {"adom": f"{values['adom']}", "pkg": f"{values['package_name']}"},
+              doc="""
+        Install the policy package on your Forti-gate Firewalls
+        :param package_name: Enter the package name you wish to install
+        :return: Response of status code with data in JSON Format
+        """),
+    _Endpoint("quick_db_install", "exec", "/securityconsole/install/device", ["device_name", "vdom"],
+              annotations={"device_name": str, "vdom": str},
+              data=lambda values: {"adom": values["adom"],
+                                   "scope": [{"name": values["device_name"], "vdom": values["vdom"]}]},
+              doc="""
+        Install the device database (interfaces, zones, ...) of a device
+        :param device_name: name of the device
+        :param vdom: vdom of the device
+        """),
+    _Endpoint("track_quick_db_install", "get", "/task/task/{taskid}", ["taskid"],
+              doc="""
+        Get the task started by quick_db_install()
+        :param taskid: id of the task
+        """),
+    _Endpoint("add_policy_package", "set", "pm/pkg/adom/{adom}/", ["name"],
+              data=lambda values: [{"name": values["name"], "type": "pkg"}],
+              doc="""
+        Can add your own policy package in FortiManager
+        :param name: Specific the Package Name
+        :return: Response of status code with data in JSON Format
+        """),
+    _Endpoint("add_install_target", "add", "pm/pkg/adom/{adom}/{pkg_name}/scope member",
+              ["device_name", "pkg_name", ("vdom", "root")], annotations={"vdom": str},
+              data=lambda values: [{"name": f"{values['device_name']}", "vdom": f"{values['vdom']}"}],
+              result="json",
+              doc="""
+        Add a device to installation target list of the policy package
+        :param device_name: name of the device
+        :param pkg_name: name of the policy package
+        :param vdom: name of the vdom (default=root)
+        :return: returns response from FortiManager api whether is was a success or failure.
+        """),
+    _Endpoint("install_policy_package_to_device", "exec", "securityconsole/install/package",
+              ["package_name", "device", "vdom"],
+              data=lambda values: {"adom": f"{values['adom']}", "pkg": f"{values['package_name']}",
+                                   "scope": [{"name": values["device"], "vdom": values["vdom"]}]},
+              doc="""
+        Install the policy package on your Forti-gate Firewalls
+        :param vdom: Sepcify the VDOM
+        :param device: Sepcify the target device name
+        :param package_name: Enter the package name you wish to install
+        :return: Response of status code with data in JSON Format
+        """),
+    # Firewall objects v6
+    _Endpoint("get_firewall_address_v6_objects", "get", "pm/config/adom/{adom}/obj/firewall/address6",
+              [("name", False)], suffix="/{name}",
+              doc="""
+        Get all the address v6 objects data stored in FortiManager
+        :return: Response of status code with data in JSON Format
+        """),
+    _Endpoint("delete_firewall_address_v6_object", "delete",
+              "pm/config/adom/{adom}/obj/firewall/address6/{object_name}", ["object_name"],
+              doc="""
+        Delete the address object if no longer needed using object name
+        :param object_name: Enter the Object name you want to delete
+        :return: Response of status code with data in JSON Format
+        """),
+    # Firewall address groups
+    _Endpoint("get_address_groups", "get", "pm/config/adom/{adom}/obj/firewall/addrgrp", [("name", False)],
+              suffix="/{name}",
+              doc="""
+        Get the address groups created in your FortiManager
+        :param name: You can filter out the specific address group which you want to see
+        :return: Response of status code with data in JSON Format
+        """),
+    _Endpoint("get_address_v6_groups", "get", "pm/config/adom/{adom}/obj/firewall/addrgrp6", [("name", False)],
+              suffix="/{name}",
+              doc="""
+        Get the address v6 groups created in your FortiManager
+        :param name: You can filter out the specific address group which you want to see
+        :return: Response of status code with data in JSON Format
+        """),
+    _Endpoint("delete_address_group", "delete", "pm/config/adom/{adom}/obj/firewall/addrgrp/{name}", ["name"],
+              data=lambda values: {},
+              doc="""
+        Delete the Address group if no longer needed
+        :param name: Specify the name of the address you wish to delete
+        :return: Response of status code with data in JSON Format
+        """),
+    _Endpoint("delete_address_v6_group", "delete", "pm/config/adom/{adom}/obj/firewall/addrgrp6/{name}", ["name"],
+              data=lambda values: {},
+              doc="""
+        Delete the Address v6 group if no longer needed
+        :param name: Specify the name of the address you wish to delete
+        :return: Response of status code with data in JSON Format
+        """),
+    # Firewall virtual IP objects
+    _Endpoint("get_firewall_vip_objects", "get", "pm/config/adom/{adom}/obj/firewall/vip", [("name", False)],
+              suffix="/{name}",
+              doc="""
+        Get all the vip objects data stored in FortiManager
+        :return: Response of status code with data in JSON Format
+        """),
+    # Header and footer policies
+    _Endpoint("get_global_header_policies", "get", "pm/config/global/pkg/{policy_package_name}/global/header/policy",
+              [("policy_package_name", "default"), ("policyid", False)], suffix="{policyid}",
+              doc="""
+        Get global header policies
+        """),
+    _Endpoint("get_firewall_header_policies", "get", "pm/config/adom/{adom}/obj/global/header/policy",
+              [("policy_package_name", "default"), ("policyid", False)], suffix="{policyid}",
+              doc="""
+        Get adom header policies
+        """),
+    _Endpoint("get_global_footer_policies", "get", "pm/config/global/pkg/{policy_package_name}/global/footer/policy",
+              [("policy_package_name", "default"), ("policyid", False)], suffix="{policyid}",
+              doc="""
+        Get global footer policies
+        """),
+    _Endpoint("get_firewall_footer_policies", "get", "pm/config/adom/{adom}/obj/global/footer/policy",
+              [("policy_package_name", "default"), ("policyid", False)], suffix="{policyid}",
+              doc="""
+        Get adom footer policies
+        """),
+    # Firewall policies
+    _Endpoint("delete_firewall_policy", "delete",
+              "pm/config/adom/{adom}/pkg/{policy_package_name}/firewall/policy/{policyid}",
+              ["policy_package_name", "policyid"],
+              doc="""
+        Delete the policy if not is use with the policyID
+        :param policy_package_name: Enter the policy package name in which you policy belongs
+        :param policyid: Enter the policy ID of the policy you want to delete
+        :return: Response of status code with data in JSON Format
+        """),
+    # Policy lookup, through the devices
+    _Endpoint("policy_lookup", "exec", "sys/proxy/json",
+              ["device", "source_interface", "source_ip", "destination_ip", "protocol", "port", ("vdom", "root")],
+              data=lambda values: {"target": [f"adom/{values['adom']}/device/{values['device']}"], "action": "get",
+                                   "resource": _policy_lookup_resource(values["source_interface"],
+                                                                       values["source_ip"], values["destination_ip"],
+                                                                       values["protocol"], values["port"],
+                                                                       values["vdom"])},
+              doc="""
+        Look up the policy of a device matching the traffic
+        :param device: name of the device
+        :param source_interface: source interface of the traffic
+        :param source_ip: source ip of the traffic
+        :param destination_ip: destination ip of the traffic
+        :param protocol: protocol number of the traffic
+        :param port: destination port of the traffic
+        :param vdom: name of the vdom (default=root)
+        """),
+    _Endpoint("get_policies_assigned_to_device", "exec", "sys/proxy/json", ["device", "vdom"],
+              data=lambda values: {"target": [f"adom/root/device/{values['device']}"], "action": "get",
+                                   "resource": f"/api/v2/cmdb/firewall/policy/?vdom={values['vdom']}"},
+              doc="""
+        Get the firewall policies of a device vdom, from the device itself
+        :param device: name of the device
+        :param vdom: name of the vdom
+        """),
+    # Interfaces and zones
+    _Endpoint("get_interfaces", "get", "pm/config/device/{device}/global/system/interface", ["device"],
+              doc="""
+        Get the interfaces of a device
+        :param device: name of the device
+        """),
+    _Endpoint("get_interface", "get", "pm/config/device/{device}/global/system/interface/{interface}",
+              ["device", "interface"],
+              doc="""
+        Get one interface of a device
+        :param device: name of the device
+        :param interface: name of the interface
+        """),
+    _Endpoint("create_zone", "add", "pm/config/device/{device_name}/vdom/{vdom}/system/zone",
+              ["device_name", "zone", "vdom"], data=lambda values: {"name": values["zone"]},
+              doc="""
+        Create a zone on a device, see create_zones() for many zones
+        :param device_name: name of the device
+        :param zone: name of the zone
+        :param vdom: vdom of the zone
+        """),
+    _Endpoint("get_zones", "get", "pm/config/device/{device_name}/vdom/{vdom}/system/zone", ["device_name", "vdom"],
+              doc="""
+        Get the zones of a device vdom
+        :param device_name: name of the device
+        :param vdom: name of the vdom
+        """),
+    _Endpoint("get_zone", "get", "pm/config/device/{device_name}/vdom/{vdom}/system/zone/{zone}",
+              ["device_name", "zone", "vdom"],
+              doc="""
+        Get one zone of a device vdom
+        :param device_name: name of the device
+        :param zone: name of the zone
+        :param vdom: name of the vdom
+        """),
+    _Endpoint("assign_interfaces_to_zone", "set", "pm/config/device/{device_name}/vdom/{vdom}/system/zone",
+              ["device_name", "zone", "interfaces_list", "vdom"], annotations={"interfaces_list": list},
+              data=lambda values: {"name": values["zone"], "interface": values["interfaces_list"]},
+              doc="""
+        Set the interfaces of a zone
+        :param device_name: name of the device
+        :param zone: name of the zone
+        :param interfaces_list: names of the interfaces
+        :param vdom: vdom of the zone
+        """),
+    _Endpoint("get_dhcp_servers", "get", "pm/config/device/{device}/vdom/{vdom}/system/dhcp/server",
+              ["device", "vdom"],
+              doc="""
+        Get the DHCP servers configured on a device vdom
+        :param device: name of the device
+        :param vdom: name of the vdom
+        """),
+    _Endpoint("get_dhcp", "exec", "sys/proxy/json", ["device"],
+              data=lambda values: {"target": [f"adom/{values['adom']}/device/{values['device']}"], "action": "get",
+                                   "resource": _DHCP_RESOURCE},
+              doc="""
+        Get dhcp details from the devices.
+        :param device: Specify name of the device.
+        """),
+    # Services
+    _Endpoint("get_services", "get", "pm/config/adom/{adom}/obj/firewall/service/custom/Custom_Service_1",
+              doc="""
+        Get the custom service Custom_Service_1, see get_service() for another service
+        """),
+    _Endpoint("get_service", "get", "pm/config/adom/{adom}/obj/firewall/service/custom/{name}", ["name"],
+              doc="""
+        Get a custom service
+        :param name: Specify name of the service.
+        """),
+    # Scripts
+    _Endpoint("create_script", "add", "/dvmdb/adom/{adom}/script/", ["name", "script_content", ("target", 0)],
+              annotations={"name": str, "script_content": str, "target": int},
+              data=lambda values: {"name": values["name"], "content": values["script_content"],
+                                   "target": values["target"], "type": 1},
+              doc="""
+        Create a script template and store it on FortiManager
+        :param name: Specify a name for the script
+        :param script_content: write the cli commands
+        :param target:
+                If Target = 0 than script runs on Device database
+                If Target = 1 than script runs on Remote FortiGate CLI
+                If Target = 2 than script runs on Policy package or Adom Database
+        Default value is set to 0
+        """),
+    _Endpoint("get_all_scripts", "get", "/dvmdb/adom/{adom}/script/",
+              doc="""
+        Get all script templates from FortiManager
+        """),
+    _Endpoint("delete_script", "delete", "/dvmdb/adom/{adom}/script/", ["name"], annotations={"name": str},
+              extra=lambda values: {"confirm": 1, "filter": ["name", "in", values["name"]]},
+              doc="""
+        Delete a script template stored on FortiManager
+        :param name: Specify the script name which needs to be deleted
+        """),
+    _Endpoint("get_script_log_output", "get",
+              "/dvmdb/adom/{adom}/script/log/output/device/{device_name}/logid/{log_id}", ["device_name", "log_id"],
+              annotations={"device_name": str, "log_id": int},
+              doc="""
+        Get the output of one script execution on [device] from FortiManager
+        :param device_name: Specify device name.
+        :param log_id: Specify the log id from get_script_output()
+        """),
+    _Endpoint("run_script_on_multiple_devices", "exec", "/dvmdb/adom/{adom}/script/execute",
+              ["script_name", "devices"], annotations={"script_name": str, "devices": List[dict]},
+              data=lambda values: {"adom": values["adom"], "scope": values["devices"], "script": values["script_name"]},
+              doc="""
+        Create a script template and store it on FortiManager
+        :param devices: Specify devices in a list of dictionaries.
+                eg. devices=[{"name": "FortiGateVM64-1", "vdom": "root"},
+                             {"name": "FortiGateVM64-2", "vdom": "test"}
+                             {"name": "FortiGateVM64-3", "vdom": "root"}]
+        :param script_name: Specify the script name that should be executed on the specified devices
+        """),
+    _Endpoint("run_script_on_single_device", "exec", "/dvmdb/adom/{adom}/script/execute",
+              ["script_name", "device_name", "vdom"],
+              annotations={"script_name": str, "device_name": str, "vdom": str},
+              data=lambda values: {"adom": values["adom"],
+                                   "scope": {"name": values["device_name"], "vdom": values["vdom"]},
+                                   "script": values["script_name"]},
+              doc="""
+        Create a script template and store it on FortiManager
+        :param device_name: Specify device name.
+        :param vdom: Specify the Vdom
+        :param script_name: Specify the script name that should be executed on the specified devices
+        """),
+)
+
+
+def _endpoint_method(endpoint, owner):
+    """
+    Build the FortiManager method of an endpoint: a closure with the signature and docstring of the endpoint
+    """
+    fields = set(_template_fields(endpoint.url + (endpoint.suffix or "")))
+    unknown = fields - set(endpoint.args) - {"adom"}
+    if unknown:
+        raise ValueError(f"{endpoint.name}: url uses {sorted(unknown)} which are not arguments")
+    kind = inspect.Parameter.POSITIONAL_OR_KEYWORD
+    signature = inspect.Signature(
+        [inspect.Parameter("self", kind)] +
+        [inspect.Parameter(name, kind, default=endpoint.defaults.get(name, inspect.Parameter.empty),
+                           annotation=endpoint.annotations.get(name, inspect.Parameter.empty))
+         for name in endpoint.args])
+    args = endpoint.args
+    defaults = tuple(endpoint.defaults.values())
+    required = len(args) - len(defaults)
+
+    def method(self, *values, **named):
+        if named or not required <= len(values) <= len(args):
+            bound = signature.bind(self, *values, **named)
+            bound.apply_defaults()
+            values = bound.args[1:]
+        elif len(values) < len(args):
+            values += defaults[len(values) - len(args):]
+        values = dict(zip(args, values), adom=self.adom)
+        url = endpoint.url.format(**values)
+        if endpoint.suffix and values[endpoint.optional]:
+            url += endpoint.suffix.format(**values)
+        param = {"url": url}
+        if endpoint.extra is not None:
+            param.update(endpoint.extra(values))
+        if endpoint.data is not None:
+            param["data"] = endpoint.data(values)
+        return self._request(endpoint.method, [param], endpoint.result)
+
+    method.__name__ = endpoint.name
+    method.__qualname__ = f"{owner.__qualname__}.{endpoint.name}"
+    method.__doc__ = endpoint.doc
+    method.__signature__ = signature
+    method.__annotations__ = dict(endpoint.annotations)
+    method.endpoint = endpoint
+    return method
+
+
+def _with_endpoints(cls):
+    """
+    Class decorator adding one method per entry of _ENDPOINTS
+    """
+    for endpoint in _ENDPOINTS:
+        if endpoint.name in cls.__dict__:
+            raise TypeError(f"{cls.__name__}.{endpoint.name} is defined in the class and in _ENDPOINTS")
+        setattr(cls, endpoint.name, _endpoint_method(endpoint, cls))
+    return cls
+
 
+@_with_endpoints
 class FortiManager:
     """
     This class will include all the methods used for executing the api calls on FortiManager.
+
+    Thread safety: one FortiManager object can be shared by many threads. login() is single-flight (the first
+    thread logs in, the others wait for its session) and all threads share the same requests session and
+    connection pool (pool_maxsize connections). set_adom() changes the default adom of every thread; use
+    "with fortimngr.using_adom(name):" to work on another adom in the current thread only, or adom_view(name)
+    for an object bound to another adom that shares this session. With coalesce_reads=True, threads sending an
+    identical "get" request at the same time share a single call and its response. A concurrency_limiter
+    (AdaptiveLimiter) caps the requests in flight to what the FortiManager answers quickly. A scheduler
+    (RequestScheduler) serves the requests of the "interactive" lane before those of the "bulk" lane, which the
+    parallel and bulk helpers use. A circuit_breaker (CircuitBreaker) makes calls fail at once with
+    CircuitOpenError while the host keeps failing. A recorder (Recorder) writes every call to a cassette which a
+    ReplayAdapter given as transport can play back offline.
     """
 
     def __init__(self, host, username="admin", password="admin", adom="root", protocol="https", verify=True,
-                 proxies=None):
+                 proxies=None, session_cache=None, pool_maxsize=None, coalesce_reads=False,
+                 concurrency_limiter=None, scheduler=None, circuit_breaker=None, timeout=None,
+                 recorder=None, transport=None):
+        self._local = threading.local()
+        self._connection = _Connection()
         self.protocol = protocol
         self.host = host
         self.username = username
@@ -29,21 +2108,145 @@ class FortiManager:
         self.adom = adom
         self.sessionid = None
         self.session = None
+        self.pool_maxsize = pool_maxsize
+        self.coalesce_reads = coalesce_reads
+        # optional AdaptiveLimiter shared by all requests of this object and its adom views
+        self.concurrency_limiter = concurrency_limiter
+        # optional RequestScheduler giving interactive calls priority over bulk ones
+        self.scheduler = scheduler
+        # optional CircuitBreaker failing requests at once while the host is down
+        self.circuit_breaker = circuit_breaker
+        # optional requests timeout (seconds or (connect, read)) for every call
+        self.timeout = timeout
+        # optional Recorder writing every call to a cassette
+        self.recorder = recorder
+        # optional requests transport adapter used instead of HTTP, eg. a ReplayAdapter
+        self.transport = transport
         self.verify = verify
         self.proxies = {} if proxies is None else proxies
         if protocol == "http":
             self.verify = False
         self.base_url = f"{protocol}://{self.host}/jsonrpc"
+        # last seen script log id per device, used by get_new_script_output()
+        self.script_log_ids = {}
+        # optional SessionCache used to reuse session ids across processes
+        self.session_cache = session_cache
+
+    @property
+    def session(self):
+        return self._connection.session
+
+    @session.setter
+    def session(self, session):
+        self._connection.session = session
+
+    @property
+    def sessionid(self):
+        return self._connection.sessionid
+
+    @sessionid.setter
+    def sessionid(self, sessionid):
+        self._connection.sessionid = sessionid
+
+    # Adom scoping
+    @property
+    def adom(self):
+        return getattr(self._local, "adom", None) or self._adom
+
+    @adom.setter
+    def adom(self, adom):
+        self._adom = adom
+
+    @contextlib.contextmanager
+    def using_adom(self, adom):
+        """
+        Use another adom for the calls made by the current thread inside the with block
+        :param adom: name of the adom
+        """
+        previous = getattr(self._local, "adom", None)
+        self._local.adom = adom
+        try:
+            yield self
+        finally:
+            self._local.adom = previous
+
+    @contextlib.contextmanager
+    def using_lane(self, lane):
+        """
+        Send the requests made by the current thread inside the with block in another lane of the scheduler
+        :param lane: name of the lane, eg. "interactive" or "bulk"
+        """
+        if self.scheduler is not None and lane is not None and lane not in self.scheduler.lanes:
+            raise ValueError(f"Unknown lane {lane}, lanes are {self.scheduler.lanes}")
+        local = self._connection.local
+        previous = getattr(local, "lane", None)
+        local.lane = lane
+        try:
+            yield self
+        finally:
+            local.lane = previous
+
+    def _bulk_lane(self):
+        """
+        Lane for the requests of the parallel and bulk helpers: the lane chosen by the caller, else the lowest
+        priority lane of the scheduler
+        """
+        lane = getattr(self._connection.local, "lane", None)
+        if lane is None and self.scheduler is not None:
+            lane = self.scheduler.lanes[-1]
+        return lane
+
+    def adom_view(self, adom):
+        """
+        Get a FortiManager object bound to another adom which shares the session and connection pool of this one.
+        Views are cheap, do not log in again and can be used concurrently, eg. one per adom in a thread pool.
+        :param adom: name of the adom
+        :return: FortiManager
+        """
+        view = copy.copy(self)
+        view._local = threading.local()
+        view._adom = adom
+        return view
+
+    def map_adoms(self, function, adoms, max_workers=8):
+        """
+        Call function(view) for the adom_view() of every adom in parallel over the shared session
+        :param function: function taking a FortiManager bound to one adom
+        :param adoms: list of adom names
+        :param max_workers: number of adoms processed at the same time
+        :return: dict of adom: result of function
+        """
+        self.login()
+        lane = self._bulk_lane()
+
+        def call(adom):
+            with self.using_lane(lane):
+                return function(self.adom_view(adom))
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return dict(zip(adoms, executor.map(call, adoms)))
 
     # Login Method
     def login(self):
         """
-        Log in to FortiManager with the details provided during object creation of this class
+        Log in to FortiManager with the details provided during object creation of this class.
+        Safe to call from many threads: only one of them logs in, the others wait and reuse its session.
         :return: Session
         """
 
+        if self.sessionid is not None and self.session is not None:
+            return self.session
+        with self._connection.lock:
+            return self._login()
+
+    def _login(self):
         if self.sessionid is None or self.session is None:
-            self.session = requests.session()
+            self.session = self._new_session()
+            if self.pool_maxsize:
+                adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_maxsize)
+                self.session.mount(f"{self.protocol}://", adapter)
+            if self.transport is not None:
+                self.session.mount(f"{self.protocol}://", self.transport)
             # check for explicit proxy handling
             # proxies = False means force not using proxies
             # proxies set like described in https://2.python-requests.org/en/latest/user/advanced/#proxies
@@ -56,6 +2259,11 @@ class FortiManager:
                 self.session.proxies.update(self.proxies)
             else:
                 self.session.trust_env = True  # obsolete as it is default
+            if self.session_cache is not None:
+                cached = self.session_cache.get(self._session_cache_key)
+                if cached is not None and self._session_valid(cached):
+                    self.sessionid = cached
+                    return self.session
             payload = \
                 {
                     "method": "exec",
@@ -77,58 +2285,55 @@ class FortiManager:
                 return self.session
             elif "session" in login.json():
                 self.sessionid = login.json()["session"]
+                if self.session_cache is not None:
+                    self.session_cache.set(self._session_cache_key, self.sessionid)
                 return self.session
 
         else:
             return self.session
 
-    def logout(self):
+    def _new_session(self):
+        return _Session(self)
+
+    @property
+    def _session_cache_key(self):
+        return f"{self.username}@{self.base_url}"
+
+    def _session_valid(self, sessionid):
         """
-        Logout from FortiManager
-        :return: Response of status code with data in JSON Format
+        Check a cached session id with a cheap sys/status call
         """
-        session = requests.session()
-        payload = \
-            {
-                "method": "exec",
-                "params":
-                    [
-                        {
-                            "url": "sys/logout"
-                        }
-                    ],
-                "session": self.sessionid
-            }
-        logout = session.post(
-            url=self.base_url, json=payload, verify=self.verify)
-        return logout.json()["result"]
+        payload = {"method": "get", "params": [{"url": "sys/status"}], "session": sessionid}
+        try:
+            status = self.session.post(url=self.base_url, json=payload, verify=self.verify).json()
+            return status["result"][0]["status"]["code"] == 0
+        except (requests.RequestException, ValueError, KeyError, IndexError):
+            return False
 
-    # Adoms Methods
-    def get_adoms(self, name=False):
+    def logout(self, end_session=None):
         """
-        Get all adoms from the FortiManager
-        :param name: Can get specific adom using name as a filter
-        :return: Response of status code with data in JSON Format
+        Logout from FortiManager
+        With a session_cache the session is shared with the other objects and processes using the same cache, so by
+        default it is left open: this object only forgets it and logs in (or reuses the cached session) again on the
+        next call. Pass end_session=True to end the shared session on FortiManager and remove it from the cache.
+        The logout request goes through the same session as the other calls (transport, recorder, circuit breaker,
+        timeout).
+        :param end_session: end the session on FortiManager; defaults to True without a session_cache, False with one
+        :return: Response of status code with data in JSON Format, an empty list when the session is left open or
+                 there is no session
         """
-        url = "dvmdb/adom"
-        if name:
-            url = f"dvmdb/adom/{name}"
-        session = self.login()
-        payload = \
-            {
-                "method": "get",
-                "params":
-                    [
-                        {
-                            "url": url,
-                            "option": "object member"
-                        }
-                    ],
-                "session": self.sessionid
-            }
-        get_adoms = session.post(url=self.base_url, json=payload, verify=self.verify)
-        return get_adoms.json()["result"]
+        if end_session is None:
+            end_session = self.session_cache is None
+        if not end_session or self.sessionid is None:
+            self.sessionid = None
+            return []
+        result = self._post({"method": "exec", "params": [{"url": "sys/logout"}]})["result"]
+        self.sessionid = None
+        if self.session_cache is not None:
+            self.session_cache.delete(self._session_cache_key)
+        return result
 
+    # Adoms Methods
     def __lock_unlock_adom(self, method, name=False):
         """
         Lock or Unlock current Adom in FortiManager 
@@ -163,262 +2368,123 @@ class FortiManager:
     def unlock_adom(self, name=False):
         return self.__lock_unlock_adom("unlock", name)
 
-    def get_devices(self):
+    def get_devices(self, model=False):
         """
+        :param model: return the devices as DeviceRecord objects instead of dicts
         :return: returns list of devices added in FortiManager
         """
-        session = self.login()
-        payload = {"method": "get", "params": [
-            {"url": f"/dvmdb/adom/{self.adom}/device/"}]}
-        payload.update({"session": self.sessionid})
-        get_devices = session.post(
-            url=self.base_url, json=payload, verify=self.verify)
-        return get_devices.json()
+        response = self._request("get", [{"url": f"/dvmdb/adom/{self.adom}/device/"}], "json")
+        if model:
+            _with_records(response.get("result", []), DeviceRecord)
+        return response
 
     def add_device(self, ip_address, username, password, name, description=False):
-        session = self.login()
-        payload = \
-            {
-                "method": "exec",
-                "params": [
-                    {"url": "dvm/cmd/add/device",
-                     "data": {"adom": f"{self.adom}", "flags": ["create_task", "nonblocking"],
-                              "device": {"adm_pass": f"{password}", "adm_usr": f"{username}", "desc": f"{description}",
-                                         "ip": f"{ip_address}",
-                                         "name": f"{name}", "mgmt_mode": 3}}}]}
-        payload.update({"session": self.sessionid})
-        add_device = session.post(
-            url=self.base_url, json=payload, verify=self.verify)
-        return add_device.json()
+        return self._request("exec", [
+            {"url": "dvm/cmd/add/device",
+             "data": {"adom": f"{self.adom}", "flags": ["create_task", "nonblocking"],
+                      "device": {"adm_pass": f"{password}", "adm_usr": f"{username}", "desc": f"{description}",
+                                 "ip": f"{ip_address}",
+                                 "name": f"{name}", "mgmt_mode": 3}}}], "json")
 
     def add_model_device(self, name, serial_no, username="admin", password="", os_ver=6, mr=4, os_type="fos",
                          platform=""):
-        # remove nonblocking from flags. With non-blocking the returned status looks like this even when the job failed, 
+        # remove nonblocking from flags. With non-blocking the returned status looks like this even when the job failed,
         # since the creation status of the job is returned:
         # [{'data': {'pid': 20172, 'taskid': 3194}, 'status': {'code': 0, 'message': 'OK'}, 'url': 'dvm/cmd/add/device'}]
         #
         # without nonblocking the failure reason is returned: 
         # [{'status': {'code': -20010, 'message': 'Serial number already in use'}, 'url': 'dvm/cmd/add/device'}]
-        session = self.login()
-        payload = {
-            "method": "exec",
-            "params": [
-                {
-                    "url": "dvm/cmd/add/device",
-                    "data": {
-                        "adom": self.adom,
-                        "flags": [
-                            "create_task"
-                        ],
-                        "device": {
-                            "name": name,
-                            "adm_usr": username,
-                            "adm_pass": password,
-                            "flags": 67371040,
-                            "sn": serial_no,
-                            "platform_str": platform,
-                            "os_ver": os_ver,
-                            "mr": mr,
-                            "os_type": os_type,
-                            "mgmt_mode": "fmg",
-                            "device_action": "add_model",
-                        }
-                    }
-                }
-            ]
-        }
-        payload.update({"session": self.sessionid})
-        add_model_device = session.post(
-            url=self.base_url, json=payload, verify=self.verify)
-        return add_model_device.json()["result"]
-
-    # Policy Package Methods
-    def get_policy_packages(self, name=False, ):
-        """
-        Get all the policy packages configured on FortiManager
-        :param name: Can get specific package using name as a filter
-        :return: Response of status code with data in JSON Format
-        """
-        url = f"pm/pkg/adom/{self.adom}/"
-        if name:
-            url = f"pm/pkg/adom/{self.adom}/{name}"
-        session = self.login()
-        payload = \
-            {
-                "method": "get",
-                "params":
-                    [
-                        {
-                            "url": url
-                        }
-                    ],
-                "session": self.sessionid
-            }
-        get_packages = session.post(
-            url=self.base_url, json=payload, verify=self.verify)
-        return get_packages.json()["result"]
-
-    def add_policy_package(self, name):
-        """
-        Can add your own policy package in FortiManager
-        :param name: Specific the Package Name
-        :return: Response of status code with data in JSON Format
-        """
-        url = f"pm/pkg/adom/{self.adom}/"
-        session = self.login()
-        payload = \
+        return self._request("exec", [
             {
-                "method": "set",
-                "params":
-                    [
-                        {
-                            "data": [{
-                                "name": name,
-                                "type": "pkg"
-                            }, ],
-                            "url": url
-                        }
+                "url": "dvm/cmd/add/device",
+                "data": {
+                    "adom": self.adom,
+                    "flags": [
+                        "create_task"
                     ],
-                "session": self.sessionid
+                    "device": {
+                        "name": name,
+                        "adm_usr": username,
+                        "adm_pass": password,
+                        "flags": 67371040,
+                        "sn": serial_no,
+                        "platform_str": platform,
+                        "os_ver": os_ver,
+                        "mr": mr,
+                        "os_type": os_type,
+                        "mgmt_mode": "fmg",
+                        "device_action": "add_model",
+                    }
+                }
             }
-        add_package = session.post(
-            url=self.base_url, json=payload, verify=self.verify)
-        return add_package.json()["result"]
-
-    def add_install_target(self, device_name, pkg_name, vdom: str = "root"):
-        """
-        Add a device to installation target list of the policy package
-        :param device_name: name of the device
-        :param pkg_name: name of the policy package
-        :param vdom: name of the vdom (default=root)
-        :return: returns response from FortiManager api whether is was a success or failure.
-        """
-        session = self.login()
-        payload = \
-            {"method": "add",
-             "params": [{"url": f"pm/pkg/adom/{self.adom}/{pkg_name}/scope member",
-                         "data": [{"name": f"{device_name}",
-                                   "vdom": f"{vdom}"}]}]}
-        payload.update({"session": self.sessionid})
-        add_installation_target = session.post(
-            url=self.base_url, json=payload, verify=self.verify)
-        return add_installation_target.json()
-
-    def get_meta_data(self):
-        """
-        Get all the meta tags present in the FortiManager
-        :return: returns meta tags present in FortiManager
-        """
-        session = self.login()
-        payload = {"method": "get", "params": [
-            {"url": "/dvmdb/_meta_fields/device"}]}
-        payload.update({"session": self.sessionid})
-        get_meta = session.post(
-            url=self.base_url, json=payload, verify=self.verify)
-        return get_meta.json()
+        ])
 
-    def add_meta_data(self, name, importance=0, status=1):
-        """
-        Add a meta tag in the FortiManager.
-        :param name: name of the meta tag
-        :param importance: importance of meta tag
-        :param status: status of meta tag whether it should be active(1) or disabled(0)
-        :return: returns response from FortiManager API whether the request was successful or not.!
-        """
-        session = self.login()
-        payload = {"method": "add",
-                   "params": [
-                       {"url": "/dvmdb/_meta_fields/device",
-                        "data": {"importance": importance, "length": 255, "name": f"{name}",
-                                 "status": status}}]}
-        payload.update({"session": self.sessionid})
-        get_meta = session.post(
-            url=self.base_url, json=payload, verify=self.verify)
-        return get_meta.json()
-
-    def assign_meta_to_device(self, device, meta_name, meta_value):
+    def assign_meta_to_devices(self, meta: dict, skip_unchanged=True, chunk_size=100):
         """
-        Assign a meta tag to the device
-        :param device: name of the device
-        :param meta_name: name of the meta tag
-        :param meta_value: value of the meta tag
-        :return: returns response from FortiManager API whether the request was successful or not.!
+        Assign meta tags to many devices and vdoms with bulk update requests
+        :param meta: dict of device name or (device name, vdom): {meta_name: meta_value, ...}
+                eg. {"FGT-1": {"region": "emea", "site-id": "101"}, ("FGT-1", "guest"): {"tier": "2"}}
+        :param skip_unchanged: read the current values of these meta fields first and only send the changes
+        :param chunk_size: number of devices/vdoms per request
+        :return: dict with "updated" and "skipped" lists of keys and the "results" of the requests
         """
-        session = self.login()
-        payload = {"method": "update",
-                   "params": [{"url": f"/dvmdb/adom/{self.adom}/device/{device}",
-                               "data": {"name": f"{device}", "meta fields": {f"{meta_name}": f"{meta_value}"}}}]}
-        payload.update({"session": self.sessionid})
-        assign_meta = session.post(
-            self.base_url, json=payload, verify=self.verify)
-        return assign_meta.json()
+        current = self._current_meta(meta, chunk_size) if skip_unchanged else {}
+        params, updated, skipped = [], [], []
+        for key, fields in meta.items():
+            device, vdom = key if isinstance(key, tuple) else (key, None)
+            existing = current.get(key, {})
+            changes = {name: f"{value}" for name, value in fields.items()
+                       if not skip_unchanged or key not in current or f"{existing.get(name)}" != f"{value}"}
+            if not changes:
+                skipped.append(key)
+                continue
+            url = f"/dvmdb/adom/{self.adom}/device/{device}" + (f"/vdom/{vdom}" if vdom else "")
+            params.append({"url": url, "data": {"name": f"{device}", "meta fields": changes}})
+            updated.append(key)
+        return {"updated": updated, "skipped": skipped, "results": self._bulk_request("update", params, chunk_size)}
 
-    def assign_meta_to_device_vdom(self, device, vdom, meta_name, meta_value):
+    def _current_meta(self, meta, chunk_size=100):
         """
-        Assign a meta tag to the device
-        :param device: name of the device
-        :param vdom: Specify the Vdom
-        :param meta_name: name of the meta tag
-        :param meta_value: value of the meta tag
-        :return: returns response from FortiManager API whether the request was successful or not.!
+        Read the current values of the meta fields used in meta, from the devices and the vdoms of its keys.
+        FortiManager only returns meta fields that are asked for with the "meta fields" option.
+        :return: dict of device name or (device name, vdom): {meta_name: meta_value, ...}
         """
-        session = self.login()
-        payload = {"method": "update",
-                   "params": [{"url": f"/dvmdb/adom/{self.adom}/device/{device}/vdom/{vdom}",
-                               "data": {"name": f"{device}", "meta fields": {f"{meta_name}": f"{meta_value}"}}}]}
-        payload.update({"session": self.sessionid})
-        assign_meta_vdom = session.post(
-            self.base_url, json=payload, verify=self.verify)
-        return assign_meta_vdom.json()
+        names = sorted({name for fields in meta.values() for name in fields})
+        devices = [key for key in meta if not isinstance(key, tuple)]
+        vdom_devices = sorted({key[0] for key in meta if isinstance(key, tuple)})
+        params = []
+        if devices:
+            params.append({"url": f"/dvmdb/adom/{self.adom}/device", "fields": ["name"], "meta fields": names,
+                           "filter": ["name", "in"] + devices})
+        params.extend({"url": f"/dvmdb/adom/{self.adom}/device/{device}/vdom", "fields": ["name"],
+                       "meta fields": names} for device in vdom_devices)
+        results = self._bulk_request("get", params, chunk_size) if params else []
+        current = {}
+        if devices:
+            for device in results.pop(0).get("data") or []:
+                current[device["name"]] = device.get("meta fields") or {}
+        for device, result in zip(vdom_devices, results):
+            for vdom in result.get("data") or []:
+                current[(device, vdom["name"])] = vdom.get("meta fields") or {}
+        return current
 
     # Firewall Object Methods
-    def get_firewall_address_objects(self, name=False):
+    def get_firewall_address_objects(self, name=False, model=False):
         """
         Get all the address objects data stored in FortiManager
+        :param name: Can get specific address object using name as a filter
+        :param model: return the objects as AddressObjectRecord objects instead of dicts
         :return: Response of status code with data in JSON Format
         """
         url = f"pm/config/adom/{self.adom}/obj/firewall/address"
-        if name:
-            url = f"pm/config/adom/{self.adom}/obj/firewall/address/{name}"
-        session = self.login()
-        payload = \
-            {
-                "method": "get",
-                "params": [
-                    {
-                        "url": url
-                    }
-                ],
-                "session": self.sessionid
-            }
-        get_address_objects = session.post(
-            url=self.base_url, json=payload, verify=self.verify)
-        return get_address_objects.json()["result"]
-
-    # Firewall Object v6 Methods
-    def get_firewall_address_v6_objects(self, name=False):
-        """
-        Get all the address v6 objects data stored in FortiManager
-        :return: Response of status code with data in JSON Format
-        """
-        url = f"pm/config/adom/{self.adom}/obj/firewall/address6"
-        if name:
-            url = f"pm/config/adom/{self.adom}/obj/firewall/address6/{name}"
-        session = self.login()
-        payload = \
-            {
-                "method": "get",
-                "params": [
-                    {
-                        "url": url
-                    }
-                ],
-                "session": self.sessionid
-            }
-        get_address_objects = session.post(
-            url=self.base_url, json=payload, verify=self.verify)
-        return get_address_objects.json()["result"]
+        if name:
+            url = f"pm/config/adom/{self.adom}/obj/firewall/address/{name}"
+        result = self._request("get", [{"url": url}])
+        if model:
+            return _with_records(result, AddressObjectRecord)
+        return result
 
+    # Firewall Object v6 Methods
     def add_firewall_address_object(self, name, subnet=None, associated_interface="any", object_type=None,
                                     allow_routing=0, fqdn=None):
         """
@@ -451,17 +2517,7 @@ class FortiManager:
                 "subnet": subnet,
                 "type": 0 if object_type is None else object_type,
             }
-
-        session = self.login()
-        payload = {
-            "method": "add",
-            "params": [{"data": data,
-                        "url": f"pm/config/adom/{self.adom}/obj/firewall/address"}],
-            "session": self.sessionid}
-
-        add_address_object = session.post(
-            url=self.base_url, json=payload, verify=self.verify)
-        return add_address_object.json()["result"]
+        return self._request("add", [{"data": data, "url": f"pm/config/adom/{self.adom}/obj/firewall/address"}])
 
     def add_firewall_address_v6_object(self, name, subnet6: str, object_type=0):
         """
@@ -471,19 +2527,11 @@ class FortiManager:
         :param object_type:
         :return: Response of status code with data in JSON Format
         """
-        session = self.login()
-        payload = {
-            "method": "add",
-            "params": [{"data": {
-                "name": name,
-                "ip6": subnet6,
-                "type": object_type},
-                "url": f"pm/config/adom/{self.adom}/obj/firewall/address6"}],
-            "session": self.sessionid}
-
-        add_address_object = session.post(
-            url=self.base_url, json=payload, verify=self.verify)
-        return add_address_object.json()["result"]
+        return self._request("add", [{"data": {
+            "name": name,
+            "ip6": subnet6,
+            "type": object_type},
+            "url": f"pm/config/adom/{self.adom}/obj/firewall/address6"}])
 
     def add_dynamic_object(self, name, device, subnet, comment=None):
         """
@@ -494,20 +2542,15 @@ class FortiManager:
         :param comment: comment
         :return: returns response of the request from FortiManager.
         """
-        session = self.login()
         add_obj = self.add_firewall_address_object(
             name, subnet=["0.0.0.0", "255.255.255.255"])
-        payload = {
-            "method": "add",
-            "params": [{"url": f"pm/config/adom/root/obj/firewall/address/{name}/dynamic_mapping",
-                        "data": [{"_scope": [{"name": f"{device}", "vdom": "root"}],
-                                  "subnet": subnet,
-                                  "comment": f"{comment}",
-                                  }]}],
-            "session": self.sessionid}
-        add_dynamic_obj = session.post(
-            url=self.base_url, json=payload, verify=self.verify)
-        return [add_obj, add_dynamic_obj.json()["result"]]
+        add_dynamic_obj = self._request("add", [
+            {"url": f"pm/config/adom/root/obj/firewall/address/{name}/dynamic_mapping",
+             "data": [{"_scope": [{"name": f"{device}", "vdom": "root"}],
+                       "subnet": subnet,
+                       "comment": f"{comment}",
+                       }]}])
+        return [add_obj, add_dynamic_obj]
 
     def update_dynamic_object(self, name, device, subnet: list, do="add", comment=None):
         """
@@ -519,21 +2562,17 @@ class FortiManager:
         :param comment: add comment if you want.
         :return: return result of the request from FortiManager.
         """
-        session = self.login()
-        payload = {
-            "params": [{"url": f"pm/config/adom/root/obj/firewall/address/{name}/dynamic_mapping",
-                        "data": [{"_scope": [{"name": f"{device}", "vdom": "root"}],
-                                  "subnet": subnet,
-                                  "comment": f"{comment}",
-                                  }]}],
-            "session": self.sessionid}
+        params = [{"url": f"pm/config/adom/root/obj/firewall/address/{name}/dynamic_mapping",
+                   "data": [{"_scope": [{"name": f"{device}", "vdom": "root"}],
+                             "subnet": subnet,
+                             "comment": f"{comment}",
+                             }]}]
+        method = None
         if do == "add":
-            payload.update(method="update")
+            method = "update"
         elif do == "remove":
-            payload.update(method="delete")
-        update_dynamic_obj = session.post(
-            url=self.base_url, json=payload, verify=self.verify)
-        return update_dynamic_obj.json()["result"]
+            method = "delete"
+        return self._request(method, params)
 
     def add_dynamic_group(self, name, device, vdom, members: list, comment=None):
         """
@@ -543,17 +2582,73 @@ class FortiManager:
         :param comment: comment
         :return: returns response of the request from FortiManager.
         """
-        session = self.login()
-        payload = {
-            "method": "add",
-            "params": [{"url": f"pm/config/adom/{self.adom}/obj/firewall/addrgrp/{name}/dynamic_mapping",
-                        "data": [{"_scope": [{"name": f"{device}", "vdom": vdom}],
-                                  "member": members,
-                                  }]}],
-            "session": self.sessionid}
-        add_dynamic_grp = session.post(
-            url=self.base_url, json=payload, verify=self.verify)
-        return add_dynamic_grp.json()["result"]
+        return self._request("add", [
+            {"url": f"pm/config/adom/{self.adom}/obj/firewall/addrgrp/{name}/dynamic_mapping",
+             "data": [{"_scope": [{"name": f"{device}", "vdom": vdom}],
+                       "member": members,
+                       }]}])
+
+    def sync_dynamic_mappings(self, mappings: dict, kind="address", remove_missing=False, chunk_size=100):
+        """
+        Set the per device mappings of many address objects or address groups, only sending the changes.
+        Existing mappings are fetched once, then new mappings are added, changed ones updated and, with
+        remove_missing, mappings that are not listed are deleted, each with one bulk request.
+        The objects themselves must already exist.
+        :param mappings: dict of object name: list of mappings
+                eg. {"Site_LAN": [{"device": "FGT-1", "vdom": "root", "subnet": ["10.1.0.0", "255.255.255.0"]},
+                                  {"device": "FGT-2", "subnet": "10.2.0.0/24", "comment": "Site 2"}]}
+                Address groups use "member": [...] instead of "subnet". vdom defaults to "root".
+        :param kind: "address" or "addrgrp"
+        :param remove_missing: delete the existing mappings of these objects that are not listed
+        :param chunk_size: number of objects per request
+        :return: dict with the "added", "updated", "deleted" and "unchanged" (object, device, vdom) keys and the
+                 "results" of the requests
+        """
+        if kind not in ("address", "addrgrp"):
+            raise ValueError("kind must be 'address' or 'addrgrp'")
+        field = "subnet" if kind == "address" else "member"
+        urls = {name: f"pm/config/adom/{self.adom}/obj/firewall/{kind}/{name}/dynamic_mapping" for name in mappings}
+        existing = {}
+        for name, result in zip(urls, self._bulk_request("get", [{"url": url} for url in urls.values()],
+                                                         chunk_size)):
+            for entry in result.get("data") or []:
+                for scope in entry.get("_scope") or []:
+                    existing[(name, scope.get("name"), scope.get("vdom"))] = entry
+
+        def normalized(value):
+            if field == "subnet":
+                return _ipv4_range(value) or value
+            return sorted(_names(value))
+
+        changes = {"add": {}, "update": {}, "delete": {}}
+        report = {"added": [], "updated": [], "deleted": [], "unchanged": []}
+        wanted = set()
+        for name, entries in mappings.items():
+            for mapping in entries:
+                key = (name, mapping["device"], mapping.get("vdom", "root"))
+                wanted.add(key)
+                data = {"_scope": [{"name": key[1], "vdom": key[2]}], field: mapping[field]}
+                if "comment" in mapping:
+                    data["comment"] = mapping["comment"]
+                current = existing.get(key)
+                if current is None:
+                    changes["add"].setdefault(name, []).append(data)
+                    report["added"].append(key)
+                elif normalized(current.get(field)) != normalized(mapping[field]) or (
+                        "comment" in mapping and current.get("comment") != mapping["comment"]):
+                    changes["update"].setdefault(name, []).append(data)
+                    report["updated"].append(key)
+                else:
+                    report["unchanged"].append(key)
+        if remove_missing:
+            for key in existing:
+                if key not in wanted:
+                    changes["delete"].setdefault(key[0], []).append({"_scope": [{"name": key[1], "vdom": key[2]}]})
+                    report["deleted"].append(key)
+        report["results"] = {method: self._bulk_request(method, [{"url": urls[name], "data": data}
+                                                                 for name, data in objects.items()], chunk_size)
+                             for method, objects in changes.items()}
+        return report
 
     def update_firewall_address_object(self, name, **data):
         """
@@ -563,21 +2658,12 @@ class FortiManager:
         :return: Response of status code with data in JSON Format
         """
         data = self.make_data(_for="object", **data)
-        session = self.login()
-        payload = \
+        return self._request("update", [
             {
-                "method": "update",
-                "params": [
-                    {
-                        "data": data,
-                        "url": f"pm/config/adom/{self.adom}/obj/firewall/address/{name}"
-                    }
-                ],
-                "session": self.sessionid
+                "data": data,
+                "url": f"pm/config/adom/{self.adom}/obj/firewall/address/{name}"
             }
-        update_firewall_object = session.post(
-            url=self.base_url, json=payload, verify=self.verify)
-        return update_firewall_object.json()["result"]
+        ])
 
     def update_firewall_address_v6_object(self, name, **data):
         """
@@ -587,113 +2673,24 @@ class FortiManager:
         :return: Response of status code with data in JSON Format
         """
         data = self.make_data(_for="object", **data)
-        session = self.login()
-        payload = \
+        return self._request("update", [
             {
-                "method": "update",
-                "params": [
-                    {
-                        "data": data,
-                        "url": f"pm/config/adom/{self.adom}/obj/firewall/address6/{name}"
-                    }
-                ],
-                "session": self.sessionid
+                "data": data,
+                "url": f"pm/config/adom/{self.adom}/obj/firewall/address6/{name}"
             }
-        update_firewall_object = session.post(
-            url=self.base_url, json=payload, verify=self.verify)
-        return update_firewall_object.json()["result"]
+        ])
 
     def delete_firewall_address_object(self, object_name):
         """
         Delete the address object if no longer needed using object name
-        :param object_name: Enter the Object name you want to delete
-        :return: Response of status code with data in JSON Format
-        """
-        session = self.login()
-        payload = \
-            {
-                "method": "delete",
-                "params": [
-                    {
-                        "url": f"pm/config/adom/{self.adom}/obj/firewall/address/{object_name}"
-                    }
-                ],
-                "session": self.sessionid
-            }
-        delete_address_object = session.post(
-            url=self.base_url, json=payload, verify=self.verify)
-        return delete_address_object.json()["result"]
-
-    def delete_firewall_address_v6_object(self, object_name):
-        """
-        Delete the address object if no longer needed using object name
-        :param object_name: Enter the Object name you want to delete
+        :param object_name: Enter the Object name you want to delete, or a list of names to delete in one request
         :return: Response of status code with data in JSON Format
         """
-        session = self.login()
-        payload = \
-            {
-                "method": "delete",
-                "params": [
-                    {
-                        "url": f"pm/config/adom/{self.adom}/obj/firewall/address6/{object_name}"
-                    }
-                ],
-                "session": self.sessionid
-            }
-        delete_address_object = session.post(
-            url=self.base_url, json=payload, verify=self.verify)
-        return delete_address_object.json()["result"]
+        names = object_name if isinstance(object_name, (list, tuple)) else [object_name]
+        return self._request("delete", [{"url": f"pm/config/adom/{self.adom}/obj/firewall/address/{name}"}
+                                        for name in names])
 
     # Firewall Address Groups Methods
-    def get_address_groups(self, name=False):
-        """
-        Get the address groups created in your FortiManager
-        :param name: You can filter out the specific address group which you want to see
-        :return: Response of status code with data in JSON Format
-        """
-        session = self.login()
-        url = f"pm/config/adom/{self.adom}/obj/firewall/addrgrp"
-        if name:
-            url = f"pm/config/adom/{self.adom}/obj/firewall/addrgrp/{name}"
-        payload = \
-            {
-                "method": "get",
-                "params": [
-                    {
-                        "url": url
-                    }
-                ],
-                "session": self.sessionid
-            }
-        get_address_group = session.post(
-            url=self.base_url, json=payload, verify=self.verify)
-        return get_address_group.json()["result"]
-
-    def get_address_v6_groups(self, name=False):
-        """
-        Get the address groups created in your FortiManager
-        :param name: You can filter out the specific address group which you want to see
-        :return: Response of status code with data in JSON Format
-        """
-        session = self.login()
-        url = f"pm/config/adom/{self.adom}/obj/firewall/addrgrp6"
-        if name:
-            url = f"pm/config/adom/{self.adom}/obj/firewall/addrgrp6/{name}"
-        payload = \
-            {
-                "method": "get",
-                "params": [
-                    {
-                        "url": url
-                    }
-                ],
-                "session": self.sessionid
-            }
-        get_address_group = session.post(
-            url=self.base_url, json=payload, verify=self.verify)
-        return get_address_group.json()["result"]
-
     def add_address_group(self, name, members=None):
         """
         Create your own group with just 2 parameters
@@ -703,24 +2700,15 @@ class FortiManager:
         """
         if members is None:
             members = []
-        session = self.login()
-        payload = \
+        return self._request("add", [
             {
-                "method": "add",
-                "params": [
-                    {
-                        "data": {
-                            "name": name,
-                            "member": members,
-                        },
-                        "url": f"pm/config/adom/{self.adom}/obj/firewall/addrgrp"
-                    }
-                ],
-                "session": self.sessionid
+                "data": {
+                    "name": name,
+                    "member": members,
+                },
+                "url": f"pm/config/adom/{self.adom}/obj/firewall/addrgrp"
             }
-        add_address_group = session.post(
-            url=self.base_url, json=payload, verify=self.verify)
-        return add_address_group.json()["result"]
+        ])
 
     def add_address_v6_group(self, name, members=None):
         """
@@ -731,24 +2719,15 @@ class FortiManager:
         """
         if members is None:
             members = []
-        session = self.login()
-        payload = \
+        return self._request("add", [
             {
-                "method": "add",
-                "params": [
-                    {
-                        "data": {
-                            "name": name,
-                            "member": members,
-                        },
-                        "url": f"pm/config/adom/{self.adom}/obj/firewall/addrgrp6"
-                    }
-                ],
-                "session": self.sessionid
+                "data": {
+                    "name": name,
+                    "member": members,
+                },
+                "url": f"pm/config/adom/{self.adom}/obj/firewall/addrgrp6"
             }
-        add_address_group = session.post(
-            url=self.base_url, json=payload, verify=self.verify)
-        return add_address_group.json()["result"]
+        ])
 
     def update_address_group(self, name, object_name, do="add"):
         """
@@ -760,30 +2739,19 @@ class FortiManager:
                     do="remove" will remove the object from address group
         :return: Response of status code with data in JSON Format
         """
-        session = self.login()
-        get_addr_group = self.get_address_groups(name=name)
-        members = get_addr_group[0]['data']['member']
+        members = self.get_address_groups(name=name)[0]['data']['member']
         if do == "add":
             members.append(object_name)
         elif do == "remove":
             members.remove(object_name)
-
-        payload = \
+        return self._request("update", [
             {
-                "method": "update",
-                "params": [
-                    {
-                        "data": {
-                            "member": members,
-                        },
-                        "url": f"pm/config/adom/{self.adom}/obj/firewall/addrgrp/{name}"
-                    }
-                ],
-                "session": self.sessionid
+                "data": {
+                    "member": members,
+                },
+                "url": f"pm/config/adom/{self.adom}/obj/firewall/addrgrp/{name}"
             }
-        update_address_group = session.post(
-            url=self.base_url, json=payload, verify=self.verify)
-        return update_address_group.json()["result"]
+        ])
 
     def update_address_v6_group(self, name, object_name, do="add"):
         """
@@ -795,300 +2763,36 @@ class FortiManager:
                     do="remove" will remove the object from address group
         :return: Response of status code with data in JSON Format
         """
-        session = self.login()
-        get_addr_v6_group = self.get_address_v6_groups(name=name)
-        members = get_addr_v6_group[0]['data']['member']
+        members = self.get_address_v6_groups(name=name)[0]['data']['member']
         if do == "add":
             members.append(object_name)
         elif do == "remove":
             members.remove(object_name)
-
-        payload = \
-            {
-                "method": "update",
-                "params": [
-                    {
-                        "data": {
-                            "member": members,
-                        },
-                        "url": f"pm/config/adom/{self.adom}/obj/firewall/addrgrp6/{name}"
-                    }
-                ],
-                "session": self.sessionid
-            }
-        update_address_group = session.post(
-            url=self.base_url, json=payload, verify=self.verify)
-        return update_address_group.json()["result"]
-
-    def delete_address_group(self, name):
-        """
-        Delete the Address group if no longer needed
-        :param name: Specify the name of the address you wish to delete
-        :return: Response of status code with data in JSON Format
-        """
-        session = self.login()
-        payload = \
-            {
-                "method": "delete",
-                "params": [
-                    {
-                        "data": {
-                        },
-                        "url": f"pm/config/adom/{self.adom}/obj/firewall/addrgrp/{name}"
-                    }
-                ],
-                "session": self.sessionid
-            }
-        delete_address_group = session.post(
-            url=self.base_url, json=payload, verify=self.verify)
-        return delete_address_group.json()["result"]
-
-    def delete_address_v6_group(self, name):
-        """
-        Delete the Address group if no longer needed
-        :param name: Specify the name of the address you wish to delete
-        :return: Response of status code with data in JSON Format
-        """
-        session = self.login()
-        payload = \
-            {
-                "method": "delete",
-                "params": [
-                    {
-                        "data": {
-                        },
-                        "url": f"pm/config/adom/{self.adom}/obj/firewall/addrgrp6/{name}"
-                    }
-                ],
-                "session": self.sessionid
-            }
-        delete_address_group = session.post(
-            url=self.base_url, json=payload, verify=self.verify)
-        return delete_address_group.json()["result"]
-
-    # Firewall Virtual IP objects
-    def get_firewall_vip_objects(self, name=False):
-        """
-        Get all the vip objects data stored in FortiManager
-        :return: Response of status code with data in JSON Format
-        """
-        url = f"pm/config/adom/{self.adom}/obj/firewall/vip"
-        if name:
-            url = f"pm/config/adom/{self.adom}/obj/firewall/vip/{name}"
-        session = self.login()
-        payload = \
+        return self._request("update", [
             {
-                "method": "get",
-                "params": [
-                    {
-                        "url": url
-                    }
-                ],
-                "session": self.sessionid
+                "data": {
+                    "member": members,
+                },
+                "url": f"pm/config/adom/{self.adom}/obj/firewall/addrgrp6/{name}"
             }
-        get_vip_objects = session.post(
-            url=self.base_url, json=payload, verify=self.verify)
-        return get_vip_objects.json()["result"]
-
-    # Header
-    def get_global_header_policies(self, policy_package_name="default", policyid=False):
-        """
-        Get global header policies
-        """
-        url = f"pm/config/global/pkg/{policy_package_name}/global/header/policy"
-        if policyid:
-            url = url + str(policyid)
-        session = self.login()
-        payload = {
-            "method": "get",
-            "params": [
-                {
-                    "url": url
-                }
-            ],
-            "session": self.sessionid
-        }
-        get_global_header_policies = session.post(url=self.base_url, json=payload, verify=self.verify)
-        return get_global_header_policies.json()["result"]
-
-    def get_firewall_header_policies(self, policy_package_name="default", policyid=False):
-        """
-        Get adom header policies
-        """
-        url = f"pm/config/adom/{self.adom}/obj/global/header/policy"
-        if policyid:
-            url = url + str(policyid)
-        session = self.login()
-        payload = {
-            "method": "get",
-            "params": [
-                {
-                    "url": url
-                }
-            ],
-            "session": self.sessionid
-        }
-        get_firewall_header_policies = session.post(url=self.base_url, json=payload, verify=self.verify)
-        return get_firewall_header_policies.json()["result"]
-
-    # Footer
-    def get_global_footer_policies(self, policy_package_name="default", policyid=False):
-        """
-        Get global footer policies
-        """
-        url = f"pm/config/global/pkg/{policy_package_name}/global/footer/policy"
-        if policyid:
-            url = url + str(policyid)
-        session = self.login()
-        payload = {
-            "method": "get",
-            "params": [
-                {
-                    "url": url
-                }
-            ],
-            "session": self.sessionid
-        }
-        get_global_footer_policies = session.post(url=self.base_url, json=payload, verify=self.verify)
-        return get_global_footer_policies.json()["result"]
-
-    def get_firewall_footer_policies(self, policy_package_name="default", policyid=False):
-        """
-        Get adom footer policies
-        """
-        url = f"pm/config/adom/{self.adom}/obj/global/footer/policy"
-        if policyid:
-            url = url + str(policyid)
-        session = self.login()
-        payload = {
-            "method": "get",
-            "params": [
-                {
-                    "url": url
-                }
-            ],
-            "session": self.sessionid
-        }
-        get_firewall_footer_policies = session.post(url=self.base_url, json=payload, verify=self.verify)
-        return get_firewall_footer_policies.json()["result"]
-
-    # Policy Lookup
-    def policy_lookup(self, device, source_interface, source_ip, destination_ip, protocol, port, vdom="root"):
-        session = self.login()
-        payload = {"method": "exec",
-                   "params": [{"url": "sys/proxy/json",
-                               "data": {
-                                   "target": [f"adom/{self.adom}/device/{device}"],
-                                   "action": "get",
-                                   "resource": f"/api/v2/monitor/firewall/policy-lookup/select?vdom={vdom}"
-                                               f"&srcintf={source_interface}"
-                                               f"&protocol={protocol}"
-                                               f"&sourceip={source_ip}"
-                                               f"&sourceport="
-                                               f"&dest={destination_ip}"
-                                               f"&destport={port}"}}]}
-        payload.update(session=self.sessionid)
-        req = session.post(url=self.base_url, json=payload, verify=self.verify)
-        return req.json()["result"]
-
-    def get_policies_assigned_to_device(self, device, vdom):
-        session = self.session
-        payload = {
-            "method": "exec",
-            "params": [
-                {"url": "sys/proxy/json",
-                 "data": {"target": [f"adom/root/device/{device}"],
-                          "action": "get",
-                          "resource": f"/api/v2/cmdb/firewall/policy/?vdom={vdom}"}}]}
-        payload.update(session=self.sessionid)
-        req = session.post(url=self.base_url, json=payload, verify=self.verify)
-        return req.json()["result"]
-
-    # Firewall Interfaces
-    def get_interfaces(self, device):
-        session = self.login()
-        payload = {"method": "get", "params": [{"url": f"pm/config/device/{device}/global/system/interface"}]}
-        payload.update(session=self.sessionid)
-        req = session.post(url=self.base_url, json=payload, verify=self.verify)
-        return req.json()["result"]
-
-    def get_interface(self, device, interface):
-        session = self.login()
-        payload = {"method": "get",
-                   "params": [{"url": f"pm/config/device/{device}/global/system/interface/{interface}"}]}
-        payload.update(session=self.sessionid)
-        req = session.post(url=self.base_url, json=payload, verify=self.verify)
-        return req.json()["result"]
-
-    # Services
-    def get_services(self):
-        """
-                Get interface details from the devices.
-                :param device: Specify name of the device.
-                """
-        session = self.login()
-        payload = \
-            {"method": "get",
-             "params": [{"url": f"pm/config/adom/{self.adom}/obj/firewall/service/custom/Custom_Service_1"}]}
-
-        payload.update(session=self.sessionid)
-        services = session.post(url=self.base_url, json=payload, verify=self.verify)
-        return services.json()["result"]
-
-    def get_service(self, name):
-        """
-        Get interface details from the devices.
-        :param name: Specify name of the device.
-        """
-        session = self.login()
-        payload = \
-            {"method": "get", "params": [{"url": f"pm/config/adom/{self.adom}/obj/firewall/service/custom/{name}"}]}
-
-        payload.update(session=self.sessionid)
-        service = session.post(url=self.base_url, json=payload, verify=self.verify)
-        return service.json()["result"]
+        ])
 
     # Firewall Policies Methods
-    def get_firewall_policies(self, policy_package_name="default", policyid=False):
+    def get_firewall_policies(self, policy_package_name="default", policyid=False, model=False):
         """
         Get the firewall policies present in the policy package
         :param policy_package_name: Enter the policy package name
         :param policyid: Can filter and get the policy you want using policyID
+        :param model: return the policies as FirewallPolicyRecord objects instead of dicts
         :return: Response of status code with data in JSON Format
         """
         url = f"pm/config/adom/{self.adom}/pkg/{policy_package_name}/firewall/policy/"
         if policyid:
             url = url + str(policyid)
-        session = self.login()
-        payload = {
-            "method": "get",
-            "params": [
-                {
-                    "url": url
-                }
-            ],
-            "session": self.sessionid
-        }
-        get_firewall_policies = session.post(
-            url=self.base_url, json=payload, verify=self.verify)
-        return get_firewall_policies.json()["result"]
-
-    def get_dhcp(self, device):
-        """
-        Get dhcp details from the devices.
-        :param device: Specify name of the device.
-        """
-        session = self.login()
-        payload = \
-            {
-                "method": "exec",
-                "params": [
-                    {"url": "sys/proxy/json",
-                     "data": {"target": [f"adom/{self.adom}/device/{device}"], "action": "get",
-                              "resource": "/api/v2/monitor/system/dhcp/select?&vdom=root&ipv6=true&scope=global"}}]}
-        payload.update(session=self.sessionid)
-        get_interfaces = session.post(url=self.base_url, json=payload, verify=self.verify)
-        return get_interfaces.json()["result"]
+        result = self._request("get", [{"url": url}])
+        if model:
+            return _with_records(result, FirewallPolicyRecord)
+        return result
 
     def add_firewall_policy(self, policy_package_name: str, name: str, source_interface: str,
                             source_address: str, destination_interface: str, destination_address: str,
@@ -1111,31 +2815,23 @@ class FortiManager:
                             logtraffic=2 Means Log All Sessions
         :return: Response of status code with data in JSON Format
         """
-        session = self.login()
-        payload = {
-            "method": "add",
-            "params": [
-                {
-                    "data": {
-                        "dstaddr": destination_address,
-                        "dstintf": destination_interface,
-                        "logtraffic": logtraffic,
-                        "name": name,
-                        "schedule": schedule,
-                        "service": service,
-                        "srcaddr": source_address,
-                        "srcintf": source_interface,
-                        "action": action,
-                        "nat": nat
-                    },
-                    "url": f"pm/config/adom/{self.adom}/pkg/{policy_package_name}/firewall/policy/"
-                }
-            ],
-            "session": self.sessionid
-        }
-        add_policy = session.post(
-            url=self.base_url, json=payload, verify=self.verify)
-        return add_policy.json()
+        return self._request("add", [
+            {
+                "data": {
+                    "dstaddr": destination_address,
+                    "dstintf": destination_interface,
+                    "logtraffic": logtraffic,
+                    "name": name,
+                    "schedule": schedule,
+                    "service": service,
+                    "srcaddr": source_address,
+                    "srcintf": source_interface,
+                    "action": action,
+                    "nat": nat
+                },
+                "url": f"pm/config/adom/{self.adom}/pkg/{policy_package_name}/firewall/policy/"
+            }
+        ], "json")
 
     def add_firewall_policy_with_v6(self, policy_package_name: str, name: str, source_interface: str,
                                     source_address: Any, source_address6: Any, destination_interface: str,
@@ -1161,33 +2857,25 @@ class FortiManager:
                             logtraffic=2 Means Log All Sessions
         :return: Response of status code with data in JSON Format
         """
-        session = self.login()
-        payload = {
-            "method": "add",
-            "params": [
-                {
-                    "data": {
-                        "dstaddr": destination_address,
-                        "dstaddr6": destination_address6,
-                        "dstintf": destination_interface,
-                        "logtraffic": logtraffic,
-                        "name": name,
-                        "schedule": schedule,
-                        "service": service,
-                        "srcaddr": source_address,
-                        "srcaddr6": source_address6,
-                        "srcintf": source_interface,
-                        "action": action,
-                        "nat": nat
-                    },
-                    "url": f"pm/config/adom/{self.adom}/pkg/{policy_package_name}/firewall/policy/"
-                }
-            ],
-            "session": self.sessionid
-        }
-        add_policy = session.post(
-            url=self.base_url, json=payload, verify=self.verify)
-        return add_policy.json()
+        return self._request("add", [
+            {
+                "data": {
+                    "dstaddr": destination_address,
+                    "dstaddr6": destination_address6,
+                    "dstintf": destination_interface,
+                    "logtraffic": logtraffic,
+                    "name": name,
+                    "schedule": schedule,
+                    "service": service,
+                    "srcaddr": source_address,
+                    "srcaddr6": source_address6,
+                    "srcintf": source_interface,
+                    "action": action,
+                    "nat": nat
+                },
+                "url": f"pm/config/adom/{self.adom}/pkg/{policy_package_name}/firewall/policy/"
+            }
+        ], "json")
 
     def update_firewall_policy(self, policy_package_name, policyid, **data):
         """
@@ -1198,43 +2886,12 @@ class FortiManager:
         :return: Response of status code with data in JSON Format
         """
         data = self.make_data(**data)
-        session = self.login()
-        payload = \
-            {
-                "method": "update",
-                "params": [
-                    {
-                        "data": data,
-                        "url": f"pm/config/adom/{self.adom}/pkg/{policy_package_name}/firewall/policy/{policyid}"
-                    }
-                ],
-                "session": self.sessionid
-            }
-        update_policy = session.post(
-            url=self.base_url, json=payload, verify=self.verify)
-        return update_policy.json()["result"]
-
-    def delete_firewall_policy(self, policy_package_name, policyid):
-        """
-        Delete the policy if not is use with the policyID
-        :param policy_package_name: Enter the policy package name in which you policy belongs
-        :param policyid: Enter the policy ID of the policy you want to delete
-        :return: Response of status code with data in JSON Format
-        """
-        session = self.login()
-        payload = \
+        return self._request("update", [
             {
-                "method": "delete",
-                "params": [
-                    {
-                        "url": f"pm/config/adom/{self.adom}/pkg/{policy_package_name}/firewall/policy/{policyid}"
-                    }
-                ],
-                "session": self.sessionid
+                "data": data,
+                "url": f"pm/config/adom/{self.adom}/pkg/{policy_package_name}/firewall/policy/{policyid}"
             }
-        delete_policy = session.post(
-            url=self.base_url, json=payload, verify=self.verify)
-        return delete_policy.json()["result"]
+        ])
 
     def move_firewall_policy(self, policy_package_name, move_policyid, option="before", policyid=None):
         """
@@ -1247,75 +2904,13 @@ class FortiManager:
         """
         if policyid is None:
             raise TypeError("move_firewall_policy() missing required argument: 'policyid'")
-        session = self.login()
-        payload = \
-            {
-                "method": "move",
-                "params": [
-                    {
-                        "url": f"pm/config/adom/{self.adom}/pkg/{policy_package_name}/firewall/policy/{move_policyid}",
-                        "option": option,
-                        "target": str(policyid)
-                    }
-                ],
-                "session": self.sessionid
-            }
-        move_policy = session.post(
-            url=self.base_url, json=payload, verify=self.verify)
-        return move_policy.json()["result"]
-
-    def install_policy_package(self, package_name):
-        """
-        Install the policy package on your Forti-gate Firewalls
-        :param package_name: Enter the package name you wish to install
-        :return: Response of status code with data in JSON Format
-        """
-        session = self.login()
-        payload = \
-            {
-                "method": "exec",
-                "params": [
-                    {
-                        "data": {
-                            "adom": f"{self.adom}",
-                            "pkg": f"{package_name}"
-                        },
-                        "url": "securityconsole/install/package"
-                    }
-                ],
-                "session": self.sessionid
-            }
-        install_package = session.post(
-            url=self.base_url, json=payload, verify=self.verify)
-        return install_package.json()["result"]
-
-    def install_policy_package_to_device(self, package_name, device, vdom):
-        """
-        Install the policy package on your Forti-gate Firewalls
-        :param vdom: Sepcify the VDOM
-        :param device: Sepcify the target device name
-        :param package_name: Enter the package name you wish to install
-        :return: Response of status code with data in JSON Format
-        """
-        session = self.login()
-        payload = \
+        return self._request("move", [
             {
-                "method": "exec",
-                "params": [
-                    {
-                        "data": {
-                            "adom": f"{self.adom}",
-                            "pkg": f"{package_name}",
-                            "scope": [{"name": device, "vdom": vdom}],
-                        },
-                        "url": "securityconsole/install/package"
-                    }
-                ],
-                "session": self.sessionid
+                "url": f"pm/config/adom/{self.adom}/pkg/{policy_package_name}/firewall/policy/{move_policyid}",
+                "option": option,
+                "target": str(policyid)
             }
-        install_package = session.post(
-            url=self.base_url, json=payload, verify=self.verify)
-        return install_package.json()["result"]
+        ])
 
     @staticmethod
     def make_data(_for="policy", **kwargs):
@@ -1437,63 +3032,42 @@ class FortiManager:
         """
         return docs
 
-    def custom_api(self, payload):
+    def _request(self, method, params, result="result"):
         """
-        Execute an API call manually by defining the payload
-        :param payload: specify the valid payload in a dict.
-        :return: returns response of the API call from FortiManager
+        Send one JSON-RPC request in the current session
+        :param method: JSON-RPC method
+        :param params: list of params
+        :param result: "result" to return the result list of the response, "json" for the whole response
         """
-        session = self.login()
-        body = dict(payload)
-        body["session"] = self.sessionid
-        custom_api = session.post(
-            url=self.base_url, json=body, verify=self.verify)
-        return custom_api.json()
+        response = self._post({"method": method, "params": params})
+        return response if result == "json" else response["result"]
 
-    def set_adom(self, adom=None):
-        self.adom = adom
-
-    # Scripts api calls
-    def create_script(self, name: str, script_content: str, target: int = 0):
+    def _post(self, payload):
         """
-        Create a script template and store it on FortiManager
-        :param name: Specify a name for the script
-        :param script_content: write the cli commands
-        :param target:
-                If Target = 0 than script runs on Device database
-                If Target = 1 than script runs on Remote FortiGate CLI
-                If Target = 2 than script runs on Policy package or Adom Database
-        Default value is set to 0
+        Send a JSON-RPC payload in the current session, logging in first if needed
+        :param payload: dict of the request without the session
+        :return: the response in JSON Format
         """
-
         session = self.login()
-        payload = \
-            {
-                "method": "add",
-                "params": [{"url": f"/dvmdb/adom/{self.adom}/script/",
-                            "data": {"name": name, "content": script_content, "target": target, "type": 1}}],
-                "session": self.sessionid
-            }
-        create_script = session.post(
-            url=self.base_url, json=payload, verify=self.verify)
-        return create_script.json()["result"]
+        body = dict(payload)
+        body["session"] = self.sessionid
+        return session.post(url=self.base_url, json=body, verify=self.verify).json()
 
-    def get_all_scripts(self):
+    def custom_api(self, payload):
         """
-        Get all script templates from FortiManager
+        Execute an API call manually by defining the payload
+        :param payload: specify the valid payload in a dict.
+        :return: returns response of the API call from FortiManager
         """
+        return self._post(payload)
 
-        session = self.login()
-        payload = \
-            {
-                "method": "get",
-                "params": [{"url": f"/dvmdb/adom/{self.adom}/script/"}],
-                "session": self.sessionid
-            }
-        create_script = session.post(
-            url=self.base_url, json=payload, verify=self.verify)
-        return create_script.json()["result"]
+    def set_adom(self, adom=None):
+        """
+        Change the default adom, for all threads using this object. See using_adom() for a per thread adom.
+        """
+        self.adom = adom
 
+    # Scripts api calls
     def update_script(self, oid: int, name: str, script_content: str, target: int = 0):
         """
         Create a script template and store it on FortiManager
@@ -1507,97 +3081,21 @@ class FortiManager:
         Default value is set to 0
         """
 
-        session = self.login()
-        payload = \
-            {
-                "method": "update",
-                "params": [{"url": f"/dvmdb/adom/{self.adom}/script/",
-                            "data":
-                                {"content": script_content,
-                                 "desc": "",
-                                 "filter_build": -1,
-                                 "filter_device": 0,
-                                 "filter_hostname": "",
-                                 "filter_ostype": 0,
-                                 "filter_osver": -1,
-                                 "filter_platform": "",
-                                 "filter_serial": "",
-                                 "name": name,
-                                 "oid": oid,
-                                 "script_schedule": None,
-                                 "target": target, "type": 1}}],
-                "session": self.sessionid
-            }
-        update_script = session.post(
-            url=self.base_url, json=payload, verify=self.verify)
-        return update_script.json()["result"]
-
-    def delete_script(self, name: str):
-        """
-        Create a script template and store it on FortiManager
-        :param name: Specify the script name which needs to be deleted
-        """
-
-        session = self.login()
-        payload = \
-            {
-                "method": "delete",
-                "params": [{"url": f"/dvmdb/adom/{self.adom}/script/", "confirm": 1,
-                            "filter": ["name", "in", name]}],
-                "session": self.sessionid
-            }
-        delete_script = session.post(
-            url=self.base_url, json=payload, verify=self.verify)
-        return delete_script.json()["result"]
-
-    def run_script_on_multiple_devices(self, script_name: str, devices: List[dict]):
-        """
-        Create a script template and store it on FortiManager
-        :param devices: Specify devices in a list of dictionaries.
-                eg. devices=[{"name": "FortiGateVM64-1", "vdom": "root"},
-                             {"name": "FortiGateVM64-2", "vdom": "test"}
-                             {"name": "FortiGateVM64-3", "vdom": "root"}]
-        :param script_name: Specify the script name that should be executed on the specified devices
-        """
-
-        session = self.login()
-        payload = \
-            {
-                "method": "exec",
-                "params": [{
-                    "data": {"adom": self.adom,
-                             "scope": devices,
-                             "script": script_name},
-                    "url": f"/dvmdb/adom/{self.adom}/script/execute"}],
-                "session": self.sessionid
-            }
-        run_script = session.post(
-            url=self.base_url, json=payload, verify=self.verify)
-        return run_script.json()["result"]
-
-    def run_script_on_single_device(self, script_name: str, device_name: str, vdom: str):
-        """
-        Create a script template and store it on FortiManager
-        :param device_name: Specify device name.
-        :param vdom: Specify the Vdom
-        :param script_name: Specify the script name that should be executed on the specified devices
-        """
-
-        session = self.login()
-        payload = \
-            {
-                "method": "exec",
-                "params": [{
-                    "data": {"adom": self.adom,
-                             "scope": {"name": device_name, "vdom": vdom},
-                             "script": script_name},
-                    "url": f"/dvmdb/adom/{self.adom}/script/execute"}],
-                "session": self.sessionid
-            }
-
-        run_script = session.post(
-            url=self.base_url, json=payload, verify=self.verify)
-        return run_script.json()["result"]
+        return self._request("update", [{"url": f"/dvmdb/adom/{self.adom}/script/",
+                                         "data":
+                                             {"content": script_content,
+                                              "desc": "",
+                                              "filter_build": -1,
+                                              "filter_device": 0,
+                                              "filter_hostname": "",
+                                              "filter_ostype": 0,
+                                              "filter_osver": -1,
+                                              "filter_platform": "",
+                                              "filter_serial": "",
+                                              "name": name,
+                                              "oid": oid,
+                                              "script_schedule": None,
+                                              "target": target, "type": 1}}])
 
     def backup_config_of_fortiGate_to_tftp(self, tftp_ip, path, script_name, filename, device_name, vdom="root"):
         """
@@ -1623,166 +3121,192 @@ class FortiManager:
                        "device": device_name, "vdom": vdom})
         return result
 
-    def get_script_output(self, device_name: str, vdom: str):
+    def get_script_output(self, device_name: str, vdom: str, since_log_id=None):
         """
         Get all scripts output from [device] on FortiManager
         :param device_name: Specify device name.
         :param vdom: Specify the Vdom
+        :param since_log_id: only get the log entries with a log id greater than this one
         """
 
-        session = self.login()
-        payload = \
-            {
-                "method": "get",
-                "params": [{
-                    "url": f"/dvmdb/adom/{self.adom}/script/log/list/device/{device_name}"}],
-                "session": self.sessionid
-            }
+        return self._request("get", [self._script_log_params(device_name, since_log_id)])
 
-        run_script = session.post(
-            url=self.base_url, json=payload, verify=self.verify)
-        return run_script.json()["result"]
+    def _script_log_params(self, device_name, since_log_id=None):
+        params = {"url": f"/dvmdb/adom/{self.adom}/script/log/list/device/{device_name}"}
+        if since_log_id is not None:
+            params["filter"] = ["log_id", ">", since_log_id]
+        return params
 
-    def quick_db_install(self, device_name: str, vdom: str):
-        session = self.login()
-        payload = {
-            "method": "exec",
-            "params": [{
-                "url": "/securityconsole/install/device",
-                "data": {"adom": self.adom, "scope": [{"name": device_name, "vdom": vdom}]}}
-            ],
-            "session": self.sessionid
-        }
-        quick_db_install = session.post(url=self.base_url, json=payload, verify=self.verify)
-        return quick_db_install.json()["result"]
-
-    def track_quick_db_install(self, taskid):
-        session = self.login()
-        payload = {
-            "method": "get",
-            "params":
-                [{"url": f"/task/task/{taskid}"}
+    def get_new_script_output(self, device_name: str):
+        """
+        Get only the script log entries of [device] that are newer than the ones returned by the previous call.
+        The last seen log id per device is kept in self.script_log_ids.
+        :param device_name: Specify device name.
+        :return: list of new log entries
+        """
+        return self.get_new_script_outputs([device_name])[device_name]
 
-                 ],
-            "session": self.sessionid
-        }
-        track_quick_db_install = session.post(url=self.base_url, json=payload, verify=self.verify)
-        return track_quick_db_install.json()["result"]
+    def get_new_script_outputs(self, devices: List[str], with_content=False, chunk_size=100):
+        """
+        Get the new script log entries of many devices, chunk_size devices per request.
+        :param devices: list of device names
+        :param with_content: also fetch the output content of every new entry (added as "content")
+        :param chunk_size: number of devices per request
+        :return: dict of device name: list of new log entries
+        """
+        params = [self._script_log_params(device, self.script_log_ids.get(device)) for device in devices]
+        results = self._bulk_request("get", params, chunk_size)
+        new_logs = {}
+        for device, result in zip(devices, results):
+            logs = result.get("data") or []
+            if isinstance(logs, dict):
+                logs = [logs]
+            last = self.script_log_ids.get(device)
+            logs = [log for log in logs if last is None or log.get("log_id", 0) > last]
+            if logs:
+                self.script_log_ids[device] = max(log.get("log_id", 0) for log in logs)
+            new_logs[device] = logs
+        if with_content:
+            wanted = [(device, log) for device, logs in new_logs.items() for log in logs]
+            params = [{"url": f"/dvmdb/adom/{self.adom}/script/log/output/device/{device}/logid/{log['log_id']}"}
+                      for device, log in wanted]
+            for (device, log), result in zip(wanted, self._bulk_request("get", params, chunk_size)):
+                log["content"] = (result.get("data") or {}).get("content")
+        return new_logs
+
+    @staticmethod
+    def _interface_data(name, interface, role, vdom, vlan, ip, mask, alias):
+        return {"name": name,
+                "ip": [ip, mask],
+                "mode": 0,
+                "allowaccess": 2,
+                "security-mode": 1,
+                "status": True,
+                "description": "Created using API",
+                "vdom": vdom,
+                "vlanid": vlan,
+                "type": 1,
+                "interface": interface,
+                "alias": alias,
+                "role": role,
+                "vrf": 0}
 
     def create_interface(self, device, name, interface, role, vdom, vlan, ip, mask, alias):
-        session = self.login()
-        payload = {"method": "add",
-                   "params": [
-                       {"url": f"pm/config/device/{device}/global/system/interface",
-                        "data":
-                            {"name": name,
-                             "ip": [ip, mask],
-                             "mode": 0,
-                             "allowaccess": 2,
-                             "security-mode": 1,
-                             "status": True,
-                             "description": "Created using API",
-                             "vdom": vdom,
-                             "vlanid": vlan,
-                             "type": 1,
-                             "interface": interface,
-                             "alias": alias,
-                             "role": role,
-                             "vrf": 0}}],
-                   "session": self.sessionid
-                   }
-        create_interface = session.post(url=self.base_url, json=payload, verify=self.verify)
-        return create_interface.json()["result"]
-
-    def create_zone(self, device_name, zone, vdom):
-        session = self.login()
-        payload = {"method": "add",
-                   "params": [
-                       {"url": f"pm/config/device/{device_name}/vdom/{vdom}/system/zone",
-                        "data": {"name": zone, }}],
-                   "session": self.sessionid
-                   }
-        create_zone = session.post(url=self.base_url, json=payload, verify=self.verify)
-        return create_zone.json()["result"]
-
-    def get_zones(self, device_name, vdom):
-        session = self.login()
-        payload = {"method": "get",
-                   "params": [
-                       {"url": f"pm/config/device/{device_name}/vdom/{vdom}/system/zone"}
-                   ],
-                   "session": self.sessionid
-                   }
-        get_zones = session.post(url=self.base_url, json=payload, verify=self.verify)
-        return get_zones.json()["result"]
-
-    def get_zone(self, device_name, zone, vdom):
-        session = self.login()
-        payload = {"method": "get",
-                   "params": [
-                       {"url": f"pm/config/device/{device_name}/vdom/{vdom}/system/zone/{zone}"}
-                   ],
-                   "session": self.sessionid
-                   }
-        get_zones = session.post(url=self.base_url, json=payload, verify=self.verify)
-        return get_zones.json()["result"]
-
-    def assign_interfaces_to_zone(self, device_name, zone, interfaces_list: list, vdom):
-        session = self.login()
-        payload = {"method": "set",
-                   "params": [
-                       {"url": f"pm/config/device/{device_name}/vdom/{vdom}/system/zone",
-                        "data": {"name": zone,
-                                 "interface": interfaces_list}}],
-                   "session": self.sessionid
-                   }
-        assign_interface_to_zone = session.post(url=self.base_url, json=payload, verify=self.verify)
-        return assign_interface_to_zone.json()["result"]
-
-    def create_device_group(self, name, description=""):
-        session = self.login()
-        payload = {"method": "add",
-                   "params": [{"url": f"/dvmdb/adom/{self.adom}/group/{name}",
-                               "data": {"name": name, "desc": description, "type": "normal",
-                                        "meta fields": {}, "os_type": "fos"}}],
-                   "session": self.sessionid
-                   }
-        create_device_group = session.post(url=self.base_url, json=payload, verify=self.verify)
-        return create_device_group.json()["result"]
-
-    def add_device_to_group(self, group, device, vdom):
-        session = self.login()
-        payload = {
-            "method": "add",
-            "params": [{"url": f"/dvmdb/adom/{self.adom}/group/{group}/object member",
-                        "data": [{"name": device, "vdom": vdom}]}],
-            "session": self.sessionid
-        }
-        add_device_in_group = session.post(url=self.base_url, json=payload, verify=self.verify)
-        return add_device_in_group.json()["result"]
-
-    def delete_device_to_group(self, group, device, vdom):
-        session = self.login()
-        payload = {
-            "method": "delete",
-            "params": [{"url": f"/dvmdb/adom/{self.adom}/group/{group}/object member",
-                        "data": [{"name": device, "vdom": vdom}]}],
-            "session": self.sessionid
-        }
-        delete_device_from_group = session.post(url=self.base_url, json=payload, verify=self.verify)
-        return delete_device_from_group.json()["result"]
+        data = self._interface_data(name, interface, role, vdom, vlan, ip, mask, alias)
+        return self._request("add", [{"url": f"pm/config/device/{device}/global/system/interface", "data": data}])
 
-    def get_device(self, device):
+    def create_interfaces(self, device, interfaces: List[dict]):
         """
-        :return: returns list of devices added in FortiManager
+        Create many VLAN interfaces on a device with one request
+        :param device: name of the device
+        :param interfaces: list of dicts with the parameters of create_interface()
+                eg. [{"name": "vlan10", "interface": "port1", "role": "lan", "vdom": "root", "vlan": 10,
+                      "ip": "10.0.10.1", "mask": "255.255.255.0", "alias": "Users"}]
         """
-        session = self.login()
-        payload = {"method": "get", "params": [
-            {"url": f"/dvmdb/adom/{self.adom}/device/{device}"}]}
-        payload.update({"session": self.sessionid})
-        get_device = session.post(
-            url=self.base_url, json=payload, verify=self.verify)
-        return get_device.json()
+        return self._request("add", [{"url": f"pm/config/device/{device}/global/system/interface",
+                                      "data": [self._interface_data(**interface) for interface in interfaces]}])
+
+    @staticmethod
+    def _zone_params(device_name, zones):
+        by_vdom = {}
+        for zone in zones:
+            data = {"name": zone["zone"]}
+            if zone.get("interfaces") is not None:
+                data["interface"] = zone["interfaces"]
+            by_vdom.setdefault(zone["vdom"], []).append(data)
+        return [{"url": f"pm/config/device/{device_name}/vdom/{vdom}/system/zone", "data": data}
+                for vdom, data in by_vdom.items()]
+
+    def create_zones(self, device_name, zones: List[dict]):
+        """
+        Create many zones on a device with one request
+        :param device_name: name of the device
+        :param zones: list of dicts eg. [{"zone": "LAN", "vdom": "root", "interfaces": ["vlan10", "vlan20"]}]
+                      interfaces is optional
+        """
+        return self._request("add", self._zone_params(device_name, zones))
+
+    def provision_device(self, device, interfaces: List[dict] = None, zones: List[dict] = None):
+        """
+        Set the interfaces and then the zones of a device with a single request.
+        Uses the "set" method, so existing interfaces/zones with the same name are overwritten.
+        :param device: name of the device
+        :param interfaces: list of dicts with the parameters of create_interface()
+        :param zones: list of dicts eg. [{"zone": "LAN", "vdom": "root", "interfaces": ["vlan10", "vlan20"]}]
+        """
+        params = []
+        if interfaces:
+            params.append({"url": f"pm/config/device/{device}/global/system/interface",
+                           "data": [self._interface_data(**interface) for interface in interfaces]})
+        if zones:
+            params.extend(self._zone_params(device, zones))
+        if not params:
+            return []
+        return self._request("set", params)
+
+    def provision_devices(self, plan: dict, max_workers=8):
+        """
+        Run provision_device() for many devices in parallel
+        :param plan: dict of device name: {"interfaces": [...], "zones": [...]}
+        :param max_workers: number of devices provisioned at the same time
+        :return: dict of device name: result of provision_device()
+        """
+        results = self._map_parallel(lambda device: self.provision_device(device, plan[device].get("interfaces"),
+                                                                          plan[device].get("zones")),
+                                     plan, max_workers)
+        return dict(zip(plan, results))
+
+    @staticmethod
+    def _group_members(members):
+        return [{"name": member, "vdom": "root"} if isinstance(member, str)
+                else {"name": member["name"], "vdom": member.get("vdom", "root")} for member in members]
+
+    def get_device_group_members(self, group):
+        """
+        Get the devices/vdoms of a device group
+        :param group: name of the device group
+        :return: list of {"name", "vdom"}
+        """
+        result = self._request("get", [{"url": f"/dvmdb/adom/{self.adom}/group/{group}/object member"}])
+        members = result[0].get("data") or []
+        return [{"name": member.get("name"), "vdom": member.get("vdom")} for member in members]
+
+    def add_devices_to_group(self, group, members: list):
+        """
+        Add many devices to a device group with one request
+        :param group: name of the device group
+        :param members: list of device names or {"name": device, "vdom": vdom} dicts (vdom defaults to root)
+        """
+        return self._request("add", [{"url": f"/dvmdb/adom/{self.adom}/group/{group}/object member",
+                                 "data": self._group_members(members)}])
+
+    def delete_devices_from_group(self, group, members: list):
+        """
+        Remove many devices from a device group with one request
+        :param group: name of the device group
+        :param members: list of device names or {"name": device, "vdom": vdom} dicts (vdom defaults to root)
+        """
+        return self._request("delete", [{"url": f"/dvmdb/adom/{self.adom}/group/{group}/object member",
+                                 "data": self._group_members(members)}])
+
+    def sync_device_group(self, group, members: list):
+        """
+        Make the members of a device group exactly the given devices/vdoms.
+        The current members are fetched once and only the missing ones are added and the extra ones removed.
+        :param group: name of the device group
+        :param members: list of device names or {"name": device, "vdom": vdom} dicts (vdom defaults to root)
+        :return: dict with the "added" and "removed" members and the "results" of the requests
+        """
+        wanted = self._group_members(members)
+        current = self.get_device_group_members(group)
+        added = [member for member in wanted if member not in current]
+        removed = [member for member in current if member not in wanted]
+        results = {}
+        if added:
+            results["add"] = self.add_devices_to_group(group, added)
+        if removed:
+            results["delete"] = self.delete_devices_from_group(group, removed)
+        return {"added": added, "removed": removed, "results": results}
 
     def create_script_group(self, name: str, target: int = 0):
         """
@@ -1796,25 +3320,930 @@ class FortiManager:
         Default value is set to 0
         """
 
-        session = self.login()
-        payload = {"method": "add",
-                   "params": [{"url": f"/dvmdb/adom/{self.adom}/script/",
-                               "data": {"name": name,
-                                        "desc": "", "target": target,
-                                        "type": 3,
-                                        "object member": []}}
-                              ],
-                   "session": self.sessionid
-                   }
-        create_script_group = session.post(url=self.base_url, json=payload, verify=self.verify)
-        return create_script_group.json()["result"]
-
-    def get_dhcp_servers(self, device, vdom):
-        session = self.login()
-        payload = {"method": "get",
-                   "params": [{
-                       "url": f"pm/config/device/{device}/vdom/{vdom}/system/dhcp/server"}],
-                   "session": self.sessionid
-                   }
-        get_dhcp_server = session.post(url=self.base_url, json=payload, verify=self.verify)
-        return get_dhcp_server.json()["result"]
+        return self._request("add", [{"url": f"/dvmdb/adom/{self.adom}/script/",
+                                      "data": {"name": name,
+                                               "desc": "", "target": target,
+                                               "type": 3,
+                                               "object member": []}}])
+
+    # Columnar export
+    def _iter_pages(self, url, page_size=1000):
+        """
+        Fetch a table page by page using the "range" option of the JSON-RPC get method
+        :param url: url of the table
+        :param page_size: number of rows fetched per request
+        :return: generator of lists of rows
+        """
+        offset = 0
+        while True:
+            result = self.custom_api({"method": "get", "params": [{"url": url, "range": [offset, page_size]}]})
+            data = result["result"][0].get("data") or []
+            if isinstance(data, dict):
+                data = [data]
+            if data:
+                yield data
+            if len(data) < page_size:
+                return
+            offset += page_size
+
+    def iter_record_batches(self, table, policy_package_name="default", page_size=5000, format=None):
+        """
+        Stream an ADOM table in columnar form, one batch per fetched page.
+        IP/subnet fields are exported as integer start/end columns for vectorized filtering.
+        :param table: one of "policies", "addresses", "vips", "devices"
+        :param policy_package_name: policy package used for the "policies" table
+        :param page_size: number of rows per request/batch
+        :param format: "arrow" for pyarrow.RecordBatch, "numpy" for numpy structured arrays
+                       Default is arrow when pyarrow is installed, numpy otherwise.
+        :return: generator of batches
+        """
+        if table not in _EXPORT_TABLES:
+            raise ValueError(f"table must be one of {sorted(_EXPORT_TABLES)}")
+        format = format or _default_columnar_format()
+        if format not in ("arrow", "numpy"):
+            raise ValueError("format must be 'arrow' or 'numpy'")
+        build_batch = _arrow_batch if format == "arrow" else _numpy_batch
+        url, columns = _EXPORT_TABLES[table]
+        url = url.format(adom=self.adom, package=policy_package_name)
+        for rows in self._iter_pages(url, page_size=page_size):
+            yield build_batch(columns, rows)
+
+    def export_table(self, table, format=None, path=None, policy_package_name="default", page_size=5000):
+        """
+        Export an ADOM table to Apache Arrow, Parquet or a NumPy structured array.
+        Integer columns are null in Arrow/Parquet and -1 in NumPy when a value is missing.
+        :param table: one of "policies", "addresses", "vips", "devices"
+        :param format: "arrow" (pyarrow.Table), "parquet" (written to path) or "numpy" (structured array)
+                       Default is arrow when pyarrow is installed, numpy otherwise.
+        :param path: output file, required for parquet
+        :param policy_package_name: policy package used for the "policies" table
+        :param page_size: number of rows per request/batch
+        :return: pyarrow.Table, numpy structured array, or the path of the written parquet file
+        """
+        if table not in _EXPORT_TABLES:
+            raise ValueError(f"table must be one of {sorted(_EXPORT_TABLES)}")
+        if format not in (None, "arrow", "parquet", "numpy"):
+            raise ValueError("format must be 'arrow', 'parquet' or 'numpy'")
+        if format == "parquet":
+            if path is None:
+                raise ValueError("path is required for parquet export")
+            import pyarrow
+            import pyarrow.parquet
+            writer = None
+            try:
+                for batch in self.iter_record_batches(table, policy_package_name, page_size, format="arrow"):
+                    if writer is None:
+                        writer = pyarrow.parquet.ParquetWriter(path, batch.schema)
+                    writer.write_table(pyarrow.Table.from_batches([batch]))
+                if writer is None:
+                    empty = _arrow_batch(_EXPORT_TABLES[table][1], [])
+                    pyarrow.parquet.write_table(pyarrow.Table.from_batches([empty]), path)
+            finally:
+                if writer is not None:
+                    writer.close()
+            return path
+        format = format or _default_columnar_format()
+        columns = _EXPORT_TABLES[table][1]
+        batches = list(self.iter_record_batches(table, policy_package_name, page_size, format=format))
+        if format == "arrow":
+            import pyarrow
+            return pyarrow.Table.from_batches(batches or [_arrow_batch(columns, [])])
+        import numpy
+        return numpy.concatenate(batches) if batches else _numpy_batch(columns, [])
+
+    # Policy analysis
+    def _get_table(self, url):
+        return [row for page in self._iter_pages(url) for row in page]
+
+    def analyze_policy_package(self, policy_package_name="default", include_overlaps=True):
+        """
+        Find shadowed, redundant and overlapping policies in a policy package.
+        See analyze_policies() for the details of the report.
+        :param policy_package_name: Enter the policy package name
+        :param include_overlaps: also report partially overlapping policies with a different action
+        :return: dict with "shadowed", "redundant", "overlaps" and "skipped" lists
+        """
+        objects = f"pm/config/adom/{self.adom}/obj/firewall"
+        return analyze_policies(
+            self._get_table(f"pm/config/adom/{self.adom}/pkg/{policy_package_name}/firewall/policy"),
+            addresses=self._get_table(f"{objects}/address"),
+            address_groups=self._get_table(f"{objects}/addrgrp"),
+            services=self._get_table(f"{objects}/service/custom"),
+            service_groups=self._get_table(f"{objects}/service/group"),
+            include_overlaps=include_overlaps)
+
+    # Address index
+    def build_address_index(self):
+        """
+        Build an AddressIndex from the address, address6, address group and VIP tables of the current adom.
+        :return: AddressIndex for containment, overlap and exact-match lookups
+        """
+        objects = f"pm/config/adom/{self.adom}/obj/firewall"
+        return AddressIndex(addresses=self._get_table(f"{objects}/address"),
+                            addresses6=self._get_table(f"{objects}/address6"),
+                            address_groups=self._get_table(f"{objects}/addrgrp"),
+                            address_groups6=self._get_table(f"{objects}/addrgrp6"),
+                            vips=self._get_table(f"{objects}/vip"))
+
+    # Bulk helpers
+    def _map_parallel(self, function, items, max_workers):
+        """
+        executor.map() on a thread pool whose threads use the adom of the calling thread and the bulk lane
+        :return: list of results, in the order of items
+        """
+        adom = self.adom
+        lane = self._bulk_lane()
+        self.login()
+
+        def call(item):
+            with self.using_adom(adom), self.using_lane(lane):
+                return function(item)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(call, items))
+
+    def metrics(self):
+        """
+        Get the state of the request path
+        :return: dict with a "concurrency" entry when a concurrency_limiter is used, a "lanes" entry when a
+        scheduler is used and a "circuit" entry when a circuit_breaker is used
+        """
+        metrics = {}
+        if self.concurrency_limiter is not None:
+            metrics["concurrency"] = self.concurrency_limiter.metrics()
+        if self.scheduler is not None:
+            metrics["lanes"] = self.scheduler.metrics()
+        if self.circuit_breaker is not None:
+            metrics["circuit"] = self.circuit_breaker.metrics()
+        return metrics
+
+    def _bulk_request(self, method, params, chunk_size=100):
+        """
+        Send many params with the same JSON-RPC method, chunk_size params per request
+        :return: list of the results of all params, in order
+        """
+        results = []
+        with self.using_lane(self._bulk_lane()):
+            for chunk in _chunks(params, chunk_size):
+                results.extend(self.custom_api({"method": method, "params": chunk})["result"])
+        return results
+
+    # Address consolidation
+    def find_duplicate_address_objects(self, addresses=None):
+        """
+        Find address objects with identical definitions (same subnet/range or FQDN and associated interface)
+        :param addresses: address objects to check, fetched from the current adom when omitted
+        :return: list of lists of object names, one list per set of duplicates
+        """
+        if addresses is None:
+            addresses = self._get_table(f"pm/config/adom/{self.adom}/obj/firewall/address")
+        found = {}
+        for obj in addresses:
+            key = _address_key(obj)
+            if key is not None:
+                found.setdefault(key, []).append(obj["name"])
+        return [sorted(names) for names in found.values() if len(names) > 1]
+
+    def plan_address_consolidation(self, duplicates=None):
+        """
+        Compute how duplicate address objects can be merged into one canonical object per set.
+        The canonical object is the most referenced one. The members and exclude-members of address groups, the
+        members of their per device mappings (dynamic_mapping) and the source/destination addresses of the firewall
+        policies in every policy package are rewritten onto it.
+        Other references (eg. VIP groups, proxy or central NAT policies, IPv6 policies) are not rewritten: the delete
+        of a duplicate still used there fails and is reported by FortiManager.
+        :param duplicates: result of find_duplicate_address_objects(), computed when omitted
+        :return: dict with "canonical" ({duplicate: canonical}), "updates" (JSON-RPC update params),
+                 "replaces" (the duplicates each update removes, in the same order) and "deletes"
+                 (names of the objects to delete)
+        """
+        if duplicates is None:
+            duplicates = self.find_duplicate_address_objects()
+        groups = self._get_table(f"pm/config/adom/{self.adom}/obj/firewall/addrgrp")
+        policies = {}
+        for path in _package_paths(self.get_policy_packages()[0].get("data")):
+            policies[path] = self._get_table(f"pm/config/adom/{self.adom}/pkg/{path}/firewall/policy")
+
+        references = {}
+        fields = [grp.get(field) for grp in groups for field in ("member", "exclude-member")]
+        fields.extend(mapping.get(field) for grp in groups for mapping in grp.get("dynamic_mapping") or []
+                      for field in ("member", "exclude-member"))
+        fields.extend(policy.get(field) for rows in policies.values() for policy in rows
+                      for field in ("srcaddr", "dstaddr"))
+        for members in fields:
+            for member in _names(members):
+                references[member] = references.get(member, 0) + 1
+        replacements = {}
+        for names in duplicates:
+            canonical = min(names, key=lambda name: (-references.get(name, 0), name))
+            replacements.update({name: canonical for name in names if name != canonical})
+
+        def replaced(row, fields):
+            return {field: _replace_members(row.get(field), replacements) for field in fields
+                    if any(member in replacements for member in _names(row.get(field)))}
+
+        def replacing(rows, fields):
+            return sorted({member for row in rows for field in fields for member in _names(row.get(field))
+                           if member in replacements})
+
+        updates, replaces = [], []
+        group_fields = ("member", "exclude-member")
+        for grp in groups:
+            url = f"pm/config/adom/{self.adom}/obj/firewall/addrgrp/{grp['name']}"
+            data = replaced(grp, group_fields)
+            if data:
+                updates.append({"url": url, "data": data})
+                replaces.append(replacing([grp], group_fields))
+            mappings = [mapping for mapping in grp.get("dynamic_mapping") or [] if replaced(mapping, group_fields)]
+            if mappings:
+                updates.append({"url": f"{url}/dynamic_mapping",
+                                "data": [dict(replaced(mapping, group_fields), _scope=mapping.get("_scope"))
+                                         for mapping in mappings]})
+                replaces.append(replacing(mappings, group_fields))
+        for path, rows in policies.items():
+            for policy in rows:
+                data = replaced(policy, ("srcaddr", "dstaddr"))
+                if data:
+                    updates.append({"url": f"pm/config/adom/{self.adom}/pkg/{path}/firewall/policy/"
+                                           f"{policy['policyid']}", "data": data})
+                    replaces.append(replacing([policy], ("srcaddr", "dstaddr")))
+        return {"canonical": replacements, "updates": updates, "replaces": replaces, "deletes": sorted(replacements)}
+
+    def apply_address_consolidation(self, plan, chunk_size=100):
+        """
+        Apply a plan from plan_address_consolidation(): bulk updates of the references first,
+        then bulk deletes of the duplicate objects whose reference updates all succeeded.
+        :param plan: result of plan_address_consolidation()
+        :param chunk_size: number of objects updated/deleted per request
+        :return: dict with the "updates" and "deletes" results and the duplicates that were "kept" because one of
+                 their reference updates failed
+        """
+        updates = self._bulk_request("update", plan["updates"], chunk_size)
+        failed = set()
+        for result, names in zip(updates, plan["replaces"]):
+            if result.get("status", {}).get("code") != 0:
+                failed.update(names)
+        deletes = []
+        for names in _chunks([name for name in plan["deletes"] if name not in failed], chunk_size):
+            deletes.extend(self.delete_firewall_address_object(names))
+        return {"updates": updates, "deletes": deletes, "kept": sorted(failed)}
+
+    # Fleet-wide proxy calls
+    def proxy_fleet(self, resource, devices=None, group=None, action="get", chunk_size=50):
+        """
+        Send one sys/proxy/json request per chunk of devices and split the responses per device
+        :param resource: FortiGate REST API resource eg. "/api/v2/monitor/system/status"
+        :param devices: list of device names
+        :param group: name of a device group, used instead of devices
+        :param action: "get", "post", "put" or "delete"
+        :param chunk_size: number of devices per request
+        :return: dict of device name: {"response": ..., "status": ...} as returned by FortiManager
+        """
+        if group is not None:
+            targets = [f"adom/{self.adom}/group/{group}"]
+        elif devices is not None:
+            targets = [f"adom/{self.adom}/device/{device}" for device in devices]
+        else:
+            raise ValueError("Provide devices or group.")
+        results = {}
+        for chunk in _chunks(targets, chunk_size):
+            payload = {"method": "exec",
+                       "params": [{"url": "sys/proxy/json",
+                                   "data": {"target": chunk, "action": action, "resource": resource}}]}
+            for entry in self.custom_api(payload)["result"][0].get("data") or []:
+                results[str(entry.get("target", "")).rsplit("/", 1)[-1]] = entry
+        return results
+
+    def policy_lookup_fleet(self, source_interface, source_ip, destination_ip, protocol, port, devices=None,
+                            group=None, vdom="root", chunk_size=50):
+        """
+        Run the same policy lookup on many devices
+        :param devices: list of device names
+        :param group: name of a device group, used instead of devices
+        :param chunk_size: number of devices per request
+        :return: dict of device name: proxy response
+        """
+        resource = _policy_lookup_resource(source_interface, source_ip, destination_ip, protocol, port, vdom)
+        return self.proxy_fleet(resource, devices=devices, group=group, chunk_size=chunk_size)
+
+    def get_policies_assigned_to_devices(self, vdom, devices=None, group=None, chunk_size=50):
+        """
+        Get the firewall policies of many devices
+        :param vdom: Specify the Vdom
+        :param devices: list of device names
+        :param group: name of a device group, used instead of devices
+        :param chunk_size: number of devices per request
+        :return: dict of device name: proxy response
+        """
+        return self.proxy_fleet(f"/api/v2/cmdb/firewall/policy/?vdom={vdom}", devices=devices, group=group,
+                                chunk_size=chunk_size)
+
+    def get_dhcp_fleet(self, devices=None, group=None, chunk_size=50):
+        """
+        Get dhcp details from many devices
+        :param devices: list of device names
+        :param group: name of a device group, used instead of devices
+        :param chunk_size: number of devices per request
+        :return: dict of device name: proxy response
+        """
+        return self.proxy_fleet(_DHCP_RESOURCE, devices=devices, group=group, chunk_size=chunk_size)
+
+    # Tasks
+    def get_tasks(self, taskids):
+        """
+        Get the state of many FortiManager tasks in one request
+        :param taskids: list of task ids
+        :return: dict of taskid: task data
+        """
+        results = self._bulk_request("get", [{"url": f"/task/task/{taskid}"} for taskid in taskids])
+        return {taskid: result.get("data") or {} for taskid, result in zip(taskids, results)}
+
+    def wait_for_tasks(self, taskids, poll_interval=5, timeout=3600):
+        """
+        Wait until the tasks are finished, polling all unfinished tasks with a single request
+        :param taskids: list of task ids
+        :param poll_interval: seconds between two polls
+        :param timeout: seconds to wait before returning, unfinished tasks are returned in their last state
+        :return: dict of taskid: task data
+        """
+        tasks = {}
+        pending = list(taskids)
+        deadline = time.monotonic() + timeout
+        while pending:
+            tasks.update(self.get_tasks(pending))
+            pending = [taskid for taskid in pending if not _task_finished(tasks[taskid])]
+            if pending and time.monotonic() + poll_interval > deadline:
+                break
+            if pending:
+                time.sleep(poll_interval)
+        return tasks
+
+    # Bulk device onboarding
+    def onboard_devices(self, devices, max_workers=8, poll_interval=5, timeout=1800):
+        """
+        Add many devices to FortiManager.
+        Devices with a serial number and no IP address are added as model devices with add_model_device(),
+        devices with an ip_address are added with add_device() and their tasks are tracked until finished.
+        Devices whose serial number or name already exists in the adom are skipped.
+        :param devices: list of dicts or path of a CSV file with the columns
+                        name, serial_no, ip_address, username, password, description, os_ver, mr, os_type, platform
+        :param max_workers: maximum number of concurrent add requests
+        :param poll_interval: seconds between two polls of the add_device tasks
+        :param timeout: seconds to wait for the add_device tasks
+        :return: list of dicts {"name", "serial_no", "status": "added"|"skipped"|"failed", "message", "taskid"}
+        """
+        if isinstance(devices, str):
+            with open(devices, newline="") as csv_file:
+                devices = [{key: value for key, value in row.items() if value not in (None, "")}
+                           for row in csv.DictReader(csv_file)]
+        existing = self.get_devices()["result"][0].get("data") or []
+        serials = {device.get("sn") for device in existing if device.get("sn")}
+        names = {device.get("name") for device in existing}
+
+        report = []
+        jobs = []
+        for device in devices:
+            entry = {"name": device["name"], "serial_no": device.get("serial_no"), "status": None, "message": "",
+                     "taskid": None}
+            report.append(entry)
+            if entry["serial_no"] and entry["serial_no"] in serials:
+                entry.update(status="skipped", message="Serial number already in use")
+            elif entry["name"] in names:
+                entry.update(status="skipped", message="Device name already in use")
+            elif not entry["serial_no"] and not device.get("ip_address"):
+                entry.update(status="failed", message="Provide serial_no or ip_address")
+            else:
+                serials.add(entry["serial_no"])
+                names.add(entry["name"])
+                jobs.append((entry, device))
+
+        for (entry, _), result in zip(jobs, self._map_parallel(lambda job: self._onboard_device(job[1]), jobs,
+                                                               max_workers)):
+            if isinstance(result, Exception):
+                entry.update(status="failed", message=str(result))
+                continue
+            code, message = _status_message(result)
+            taskid = (result[0].get("data") or {}).get("taskid") if code == 0 else None
+            if code != 0:
+                entry.update(status="failed", message=message)
+            else:
+                entry.update(status="added" if taskid is None else "pending", message=message, taskid=taskid)
+
+        tracked = [entry for entry in report if entry["taskid"] is not None]
+        tasks = self.wait_for_tasks([entry["taskid"] for entry in tracked], poll_interval, timeout)
+        for entry in tracked:
+            task = tasks.get(entry["taskid"], {})
+            if _task_succeeded(task):
+                entry.update(status="added", message="OK")
+            else:
+                entry.update(status="failed", message=f"Task state {task.get('state')}" if _task_finished(task)
+                             else "Task did not finish before timeout")
+        return report
+
+    def _onboard_device(self, device):
+        try:
+            if device.get("ip_address"):
+                return self.add_device(ip_address=device["ip_address"], username=device.get("username", "admin"),
+                                       password=device.get("password", ""), name=device["name"],
+                                       description=device.get("description", False))["result"]
+            return self.add_model_device(name=device["name"], serial_no=device["serial_no"],
+                                         username=device.get("username", "admin"),
+                                         password=device.get("password", ""), os_ver=int(device.get("os_ver", 6)),
+                                         mr=int(device.get("mr", 4)), os_type=device.get("os_type", "fos"),
+                                         platform=device.get("platform", ""))
+        except Exception as error:
+            return error
+
+    def _run_task_window(self, jobs, submit, max_concurrent, poll_interval, deadline, stop=None):
+        """
+        Start one FortiManager task per job while keeping at most max_concurrent of them running; a new job is
+        started as soon as a running task finishes. All running tasks are polled with one request.
+        :param jobs: iterable of jobs
+        :param submit: function(job) returning (taskid, message); taskid is None if the task could not be started
+        :param deadline: time.monotonic() value after which no job is started and running tasks are given up
+        :param stop: function() checked before starting each job, no further job is started once it returns True
+        :return: generator of (job, taskid, task) in completion order. task is {"state": "error", "detail": message}
+                 when the job could not be started and None when it was not started or did not finish in time.
+        """
+        pending = list(jobs)
+        running = {}
+        while (pending or running) and time.monotonic() < deadline:
+            while pending and len(running) < max_concurrent and not (stop and stop()):
+                job = pending.pop(0)
+                taskid, message = submit(job)
+                if taskid is None:
+                    yield job, None, {"state": "error", "detail": message}
+                else:
+                    running[taskid] = job
+            if not running:
+                break
+            tasks = self.get_tasks(list(running))
+            finished = [taskid for taskid, task in tasks.items() if _task_finished(task)]
+            for taskid in finished:
+                yield running.pop(taskid), taskid, tasks[taskid]
+            if running and not finished:
+                time.sleep(poll_interval)
+        for taskid, job in running.items():
+            yield job, taskid, None
+        for job in pending:
+            yield job, None, None
+
+    # Script orchestration
+    def run_script_in_waves(self, script_name: str, devices: List[dict], wave_size=100, max_concurrent_tasks=4,
+                            poll_interval=5, timeout=3600, gather_output=True, max_workers=16):
+        """
+        Run a script on a large list of devices in waves and gather the outputs.
+        Each wave is one script execution task; at most max_concurrent_tasks waves run at the same time and a new
+        wave is started as soon as one finishes. Outputs are then fetched for all devices in parallel.
+        :param script_name: Specify the script name that should be executed on the specified devices
+        :param devices: Specify devices in a list of dictionaries eg. [{"name": "FortiGateVM64-1", "vdom": "root"}]
+        :param wave_size: number of devices per script execution task
+        :param max_concurrent_tasks: maximum number of script tasks running on FortiManager at the same time
+        :param poll_interval: seconds between two polls of the running tasks
+        :param timeout: seconds after which waves that have not been started or finished are given up
+        :param gather_output: fetch the script output of every device. Only log entries written after the waves
+                              were submitted are used; output is None for a device without one.
+        :param max_workers: number of parallel requests used to gather the outputs
+        :return: dict of device name: {"vdom", "taskid", "state", "detail", "output"}
+        """
+        results = {device["name"]: {"vdom": device.get("vdom"), "taskid": None, "state": "not started",
+                                    "detail": "", "output": None} for device in devices}
+        last_log_ids = self._last_script_log_ids(list(results), wave_size) if gather_output else {}
+
+        def run_wave(wave):
+            return _started_task(self.run_script_on_multiple_devices(script_name=script_name, devices=wave))
+
+        for wave, taskid, task in self._run_task_window(_chunks(devices, wave_size), run_wave, max_concurrent_tasks,
+                                                        poll_interval, time.monotonic() + timeout):
+            lines = {line.get("name"): line for line in (task or {}).get("line") or []}
+            for device in wave:
+                line = lines.get(device["name"], task)
+                results[device["name"]].update(taskid=taskid, state=_task_outcome(taskid, line),
+                                               detail=(line or {}).get("detail", ""))
+
+        if gather_output:
+            executed = [name for name, result in results.items() if result["taskid"] is not None]
+            outputs = self._map_parallel(
+                lambda name: self._latest_script_output(name, script_name, last_log_ids.get(name)), executed,
+                max_workers)
+            for name, output in zip(executed, outputs):
+                results[name]["output"] = output
+        return results
+
+    def _last_script_log_ids(self, devices, chunk_size=100):
+        """
+        :return: dict of device name: highest script log id of the device, for the devices that have a log
+        """
+        last_log_ids = {}
+        results = self._bulk_request("get", [self._script_log_params(device) for device in devices], chunk_size)
+        for device, result in zip(devices, results):
+            logs = result.get("data") or []
+            if isinstance(logs, dict):
+                logs = [logs]
+            if logs:
+                last_log_ids[device] = max(log.get("log_id", 0) for log in logs)
+        return last_log_ids
+
+    def _latest_script_output(self, device_name, script_name, since_log_id=None):
+        logs = self.get_script_output(device_name=device_name, vdom=None, since_log_id=since_log_id)[0].get("data")
+        logs = [log for log in logs or [] if log.get("script_name") in (None, script_name)
+                and (since_log_id is None or log.get("log_id", 0) > since_log_id)]
+        if not logs:
+            return None
+        latest = max(logs, key=lambda log: log.get("log_id", 0))
+        output = self.get_script_log_output(device_name, latest["log_id"])[0].get("data") or {}
+        return output.get("content")
+
+    # Configuration backups
+    def backup_configs(self, devices: List[str], store_path, chunk_size=20, max_workers=4):
+        """
+        Back up the configuration of many devices through FortiManager into a local content-addressed store.
+        Configurations are fetched with sys/proxy/json, chunk_size devices per request and max_workers requests
+        in parallel, and stored gzip compressed as <store_path>/objects/<sha256[:2]>/<sha256[2:]>.gz. Unchanged
+        configurations are not written again; <store_path>/devices/<device> holds the hash of the latest backup of
+        each device. Each configuration is returned whole in the JSON-RPC response, so the configurations of a chunk
+        are held in memory until they are written. Device names that are not valid file names (eg. containing "/"
+        or "..") are not backed up and get an error.
+        :param devices: list of device names
+        :param store_path: directory of the backup store
+        :param chunk_size: number of devices per request
+        :param max_workers: number of parallel requests
+        :return: dict of device name: {"sha256", "path", "stored", "changed"} or {"error": message}
+        """
+        results = {}
+        for device in devices:
+            try:
+                _check_device_name(device)
+            except ValueError as error:
+                results[device] = {"error": str(error)}
+        valid = [device for device in devices if device not in results]
+
+        def backup_chunk(chunk):
+            chunk_results = {}
+            responses = self.proxy_fleet(_CONFIG_BACKUP_RESOURCE, devices=chunk, chunk_size=len(chunk))
+            for device in chunk:
+                entry = responses.get(device)
+                if entry is None or (entry.get("status") or {}).get("code", 0) != 0 or not entry.get("response"):
+                    message = ((entry or {}).get("status") or {}).get("message", "No configuration returned")
+                    chunk_results[device] = {"error": message}
+                    continue
+                content = entry["response"]
+                if not isinstance(content, str):
+                    content = json.dumps(content, sort_keys=True)
+                chunk_results[device] = _store_config(store_path, device, content)
+            return chunk_results
+
+        for chunk_results in self._map_parallel(backup_chunk, _chunks(valid, chunk_size), max_workers):
+            results.update(chunk_results)
+        return {device: results[device] for device in devices}
+
+    # Policy package install waves
+    def install_policy_package_in_waves(self, package_name, devices: List[dict], max_concurrent=5, canary=1,
+                                        max_failure_ratio=0.1, poll_interval=5, timeout=7200):
+        """
+        Install a policy package on many devices, one install task per device, keeping at most max_concurrent
+        installs running. The canary devices are installed first and the rollout stops if one of them fails.
+        Afterwards no new install is started once the ratio of failed installs exceeds max_failure_ratio.
+        :param package_name: Enter the package name you wish to install
+        :param devices: Specify devices in a list of dictionaries eg. [{"name": "FortiGateVM64-1", "vdom": "root"}]
+        :param max_concurrent: maximum number of install tasks running at the same time
+        :param canary: number of devices installed (and checked) before the rest
+        :param max_failure_ratio: stop starting installs when failed / finished installs exceeds this ratio
+        :param poll_interval: seconds between two polls of the running tasks
+        :param timeout: seconds after which installs that have not been started or finished are given up
+        :return: dict with "stopped" (reason or None) and "devices": list of
+                 {"name", "vdom", "taskid", "state": "done"|"failed"|"timeout"|"not started", "detail"}
+        """
+        report = {"stopped": None, "devices": []}
+        counts = {"done": 0, "failed": 0}
+        deadline = time.monotonic() + timeout
+
+        def install(device):
+            return _started_task(self.install_policy_package_to_device(package_name, device["name"],
+                                                                       device.get("vdom", "root")))
+
+        def failure_ratio_exceeded():
+            finished = counts["done"] + counts["failed"]
+            if finished and counts["failed"] / finished > max_failure_ratio:
+                report["stopped"] = report["stopped"] or f"failure ratio above {max_failure_ratio}"
+            return report["stopped"] is not None
+
+        canaries = devices[:canary]
+        for wave in (canaries, devices[canary:]):
+            for device, taskid, task in self._run_task_window(wave, install, max_concurrent, poll_interval, deadline,
+                                                              stop=failure_ratio_exceeded):
+                state = _task_outcome(taskid, task)
+                counts[state] = counts.get(state, 0) + 1
+                report["devices"].append({"name": device["name"], "vdom": device.get("vdom", "root"),
+                                          "taskid": taskid, "state": state,
+                                          "detail": (task or {}).get("detail", "")})
+            if wave is canaries and counts["failed"]:
+                report["stopped"] = report["stopped"] or "canary install failed"
+        return report
+
+
+# Load generation
+class StandInServer:
+    """
+    Local JSON-RPC server answering the calls used by run_load() like a small FortiManager, for development and CI.
+    It knows one adom, devices, one policy package and address objects, and answers sys/proxy/json for every
+    target. Use it with FortiManager(host=server.address, protocol="http").
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, devices=10, policies=100):
+        """
+        :param host: address to listen on
+        :param port: port to listen on, 0 for a free port
+        :param latency: seconds added to every answer
+        :param devices: number of devices (named FGT0, FGT1, ...)
+        :param policies: number of policies in every policy package
+        """
+        import http.server
+        self.latency = latency
+        self.devices = [{"name": f"FGT{index}", "sn": f"FGVM0000000{index:05d}", "ip": f"10.0.{index // 250}."
+                         f"{index % 250 + 1}", "conn_status": 1, "os_ver": 7, "mr": 2} for index in range(devices)]
+        self.policies = [{"policyid": index + 1, "name": f"policy{index + 1}", "srcintf": ["any"],
+                          "dstintf": ["any"], "srcaddr": ["all"], "dstaddr": ["all"], "service": ["ALL"],
+                          "action": 1} for index in range(policies)]
+        self.addresses = {}
+        self.requests = 0
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                answer = json.dumps(server.answer(json.loads(body or b"{}"))).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(answer)))
+                self.end_headers()
+                self.wfile.write(answer)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = http.server.ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def address(self):
+        """
+        host:port to give to FortiManager(host=...)
+        """
+        host, port = self._server.server_address[:2]
+        return f"{host}:{port}"
+
+    def answer(self, payload):
+        """
+        :param payload: JSON-RPC request
+        :return: JSON-RPC response
+        """
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.requests += 1
+            results = [self._answer_param(payload.get("method"), param) for param in payload.get("params") or [{}]]
+        response = {"id": payload.get("id", 1), "result": results}
+        if results[0]["url"] == "sys/login/user":
+            response["session"] = "stand-in-session"
+        return response
+
+    def _answer_param(self, method, param):
+        url = (param.get("url") or "").strip("/")
+        parts = url.split("/")
+        result = {"url": param.get("url"), "status": {"code": 0, "message": "OK"}}
+        if url in ("sys/login/user", "sys/logout"):
+            return result
+        if url == "sys/status":
+            result["data"] = {"Version": "v7.2.0-stand-in"}
+        elif url == "sys/proxy/json":
+            result["data"] = [{"target": target, "status": {"code": 0, "message": "OK"},
+                               "response": {"status": "success", "results": [{"policy_id": 1, "success": True}]}}
+                              for target in param.get("data", {}).get("target", [])]
+        elif parts[:2] == ["dvmdb", "adom"] and parts[3:] == ["device"]:
+            result["data"] = self.devices
+        elif parts[:2] == ["pm", "config"] and parts[4:5] == ["pkg"] and parts[6:8] == ["firewall", "policy"]:
+            result["data"] = self.policies
+        elif parts[:2] == ["pm", "config"] and parts[4:7] == ["obj", "firewall", "address"]:
+            name = parts[7] if len(parts) > 7 else (param.get("data") or {}).get("name")
+            if method in ("add", "set") and name:
+                if method == "add" and name in self.addresses:
+                    result["status"] = {"code": -2, "message": "Object already exists"}
+                else:
+                    self.addresses[name] = param.get("data")
+                    result["data"] = {"name": name}
+            elif method == "delete":
+                if self.addresses.pop(name, None) is None:
+                    result["status"] = {"code": -3, "message": "Object does not exist"}
+            elif method == "get":
+                result["data"] = self.addresses.get(name) if name else list(self.addresses.values())
+        else:
+            result["status"] = {"code": -3, "message": "Object does not exist"}
+        return result
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def _load_address_pair(fortimanager, options, number):
+    name = f"loadgen-{os.getpid()}-{threading.get_ident()}-{number}"
+    added = fortimanager.add_firewall_address_object(name, subnet=f"198.18.{number // 256 % 256}.{number % 256}/32")
+    if _status_message(added)[0] != 0:
+        return added
+    return fortimanager.delete_firewall_address_object(name)
+
+
+_LOAD_OPERATIONS = {
+    "get_firewall_policies": lambda fortimanager, options, number:
+        fortimanager.get_firewall_policies(options["package"]),
+    "get_devices": lambda fortimanager, options, number: fortimanager.get_devices(),
+    "address_pair": _load_address_pair,
+    "policy_lookup": lambda fortimanager, options, number:
+        fortimanager.policy_lookup(options["device"], "any", "10.0.0.1", "8.8.8.8", 6, 443),
+}
+DEFAULT_LOAD_MIX = {"get_firewall_policies": 4, "get_devices": 4, "address_pair": 1, "policy_lookup": 1}
+
+
+def _load_failed(result):
+    if isinstance(result, dict):
+        result = result.get("result")
+    return _status_message(result)[0] != 0
+
+
+def _load_summary(samples, seconds):
+    latencies = [latency for _, latency, _ in samples]
+    errors = sum(1 for _, _, failed in samples if failed)
+    summary = {"requests": len(samples), "errors": errors,
+               "error_rate": errors / len(samples) if samples else 0.0,
+               "throughput": len(samples) / seconds if seconds else 0.0}
+    for percent in (50, 95, 99):
+        summary[f"p{percent}"] = _percentile(latencies, percent)
+    summary["max"] = max(latencies) if latencies else None
+    return summary
+
+
+def _format_load_summary(label, summary):
+    def milliseconds(value):
+        return "-" if value is None else f"{value * 1000:.1f}ms"
+
+    return (f"{label:>22} {summary['requests']:>7} ops {summary['throughput']:>8.1f}/s "
+            f"errors {summary['error_rate']:>6.1%}  p50 {milliseconds(summary['p50']):>9} "
+            f"p95 {milliseconds(summary['p95']):>9} p99 {milliseconds(summary['p99']):>9}")
+
+
+def run_load(fortimanager, mix=None, duration=30, concurrency=8, rate=None, interval=5, device="FGT0",
+             package="default", report=print):
+    """
+    Drive a mix of calls against FortiManager and measure throughput, latency percentiles and error rates.
+    Without rate, concurrency workers send calls back to back (closed loop); with rate, calls are started at that
+    rate over all workers, which is only reached if concurrency is high enough for the latency.
+    :param fortimanager: FortiManager object, logged in on first use
+    :param mix: dict of operation: weight, operations are get_firewall_policies, get_devices, address_pair (add and
+    delete a temporary address object) and policy_lookup. Default is DEFAULT_LOAD_MIX
+    :param duration: seconds to run
+    :param concurrency: number of worker threads
+    :param rate: target calls per second, None to send as fast as the workers can
+    :param interval: seconds per line of the progress report
+    :param device: device used by policy_lookup
+    :param package: policy package read by get_firewall_policies
+    :param report: function called with one line of text per interval, None for no progress report
+    :return: dict with "intervals": list of per interval summaries, "total" and "operations": summaries over the
+    whole run. Summaries hold requests, errors, error_rate, throughput (calls/s) and p50, p95, p99, max latency (s)
+    """
+    import random
+    mix = dict(DEFAULT_LOAD_MIX if mix is None else mix)
+    unknown = set(mix) - set(_LOAD_OPERATIONS)
+    if unknown:
+        raise ValueError(f"Unknown operations {sorted(unknown)}, use {sorted(_LOAD_OPERATIONS)}")
+    operations = list(mix)
+    weights = [mix[operation] for operation in operations]
+    options = {"device": device, "package": package}
+    fortimanager.login()
+    samples = []
+    lock = threading.Lock()
+    counter = iter(range(sys.maxsize))
+    start = time.monotonic()
+    end = start + duration
+
+    def worker(seed):
+        chooser = random.Random(seed)
+        while True:
+            with lock:
+                number = next(counter)
+            if rate:
+                delay = start + number / rate - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            began = time.monotonic()
+            if began >= end:
+                return
+            operation = chooser.choices(operations, weights)[0]
+            try:
+                failed = _load_failed(_LOAD_OPERATIONS[operation](fortimanager, options, number))
+            except Exception:
+                failed = True
+            finished = time.monotonic()
+            with lock:
+                samples.append((finished - start, operation, finished - began, failed))
+
+    threads = [threading.Thread(target=worker, args=(seed,), daemon=True) for seed in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    intervals = []
+    reported = 0
+    while any(thread.is_alive() for thread in threads) or reported < duration:
+        time.sleep(max(0.0, min(interval, start + reported + interval - time.monotonic())))
+        if reported >= duration and not any(thread.is_alive() for thread in threads):
+            break
+        window_end = reported + interval
+        with lock:
+            window = [(operation, latency, failed) for at, operation, latency, failed in samples
+                      if reported <= at < window_end]
+        summary = _load_summary(window, interval)
+        summary["start"] = reported
+        intervals.append(summary)
+        if report is not None:
+            report(_format_load_summary(f"{reported:.0f}-{window_end:.0f}s", summary))
+        reported = window_end
+    for thread in threads:
+        thread.join()
+    elapsed = max(samples[-1][0], duration) if samples else duration
+    result = {"intervals": intervals,
+              "total": _load_summary([sample[1:] for sample in samples], elapsed),
+              "operations": {operation: _load_summary([sample[1:] for sample in samples if sample[1] == operation],
+                                                      elapsed) for operation in operations}}
+    if report is not None:
+        report(_format_load_summary("total", result["total"]))
+        for operation, summary in result["operations"].items():
+            report(_format_load_summary(operation, summary))
+    return result
+
+
+def load_main(argv=None):
+    """
+    Command line entry point of run_load(), installed as pyfortimanager-load
+    """
+    import argparse
+    parser = argparse.ArgumentParser(prog="pyfortimanager-load",
+                                     description="Measure how many JSON-RPC calls a FortiManager can handle.")
+    parser.add_argument("--host", help="FortiManager address, omit with --stand-in")
+    parser.add_argument("--username", default="admin")
+    parser.add_argument("--password", default=os.environ.get("FMG_PASSWORD", "admin"),
+                        help="default is $FMG_PASSWORD or admin")
+    parser.add_argument("--adom", default="root")
+    parser.add_argument("--protocol", default="https", choices=["https", "http"])
+    parser.add_argument("--no-verify", action="store_true", help="do not verify the TLS certificate")
+    parser.add_argument("--mix", default=",".join(f"{name}={weight}" for name, weight in DEFAULT_LOAD_MIX.items()),
+                        help="operation=weight list, default %(default)s")
+    parser.add_argument("--duration", type=float, default=30, help="seconds, default %(default)s")
+    parser.add_argument("--concurrency", type=int, default=8, help="worker threads, default %(default)s")
+    parser.add_argument("--rate", type=float, help="target calls per second, default is as fast as possible")
+    parser.add_argument("--interval", type=float, default=5, help="seconds per report line, default %(default)s")
+    parser.add_argument("--device", default="FGT0", help="device used by policy_lookup")
+    parser.add_argument("--package", default="default", help="policy package read by get_firewall_policies")
+    parser.add_argument("--stand-in", action="store_true", help="run against a local StandInServer")
+    parser.add_argument("--stand-in-latency", type=float, default=0.0, help="seconds added by the stand-in")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args(argv)
+    if not args.host and not args.stand_in:
+        parser.error("--host or --stand-in is required")
+    mix = {}
+    for item in args.mix.split(","):
+        name, _, weight = item.partition("=")
+        mix[name.strip()] = float(weight or 1)
+    server = StandInServer(latency=args.stand_in_latency).start() if args.stand_in else None
+    try:
+        fortimanager = FortiManager(server.address if server else args.host, args.username, args.password,
+                                    adom=args.adom, protocol="http" if server else args.protocol,
+                                    verify=not args.no_verify, pool_maxsize=args.concurrency)
+        result = run_load(fortimanager, mix, args.duration, args.concurrency, args.rate, args.interval,
+                          args.device, args.package)
+        fortimanager.logout()
+    finally:
+        if server is not None:
+            server.stop()
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(result, file, indent=2)
+    return 1 if result["total"]["requests"] == 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(load_main())